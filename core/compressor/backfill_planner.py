@@ -9,6 +9,9 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Terminal statuses: a date is complete once every partition reached one of these
+DONE_STATUSES = frozenset(('success', 'quarantine', 'skipped'))
+
 class BackfillPlanner:
     def __init__(self, raw_dates: Set[str], state_manager, today: str):
         self.raw_dates = sorted(list(raw_dates))
@@ -19,28 +22,18 @@ class BackfillPlanner:
     def get_completed_dates(self) -> Set[str]:
         """Dates considered 'done' (Success, Quarantine, or Skipped/Partial)"""
         # 1. Check day-level status
-        completed = set()
-        day_states = self.state.get("days", {})
-        for date, entry in day_states.items():
-            if entry.get("status") in ['success', 'quarantine', 'skipped']:
-                completed.add(date)
-
-        # 2. Check partition-level status
-        partition_states = self.state.get("partitions", {})
-        date_map = {}
-        
-        # Group partition statuses by date
-        for key, entry in partition_states.items():
-            date = key.split('/')[-1]
-            if date in completed:
+        completed = {date for date, entry in self.state.get("days", {}).items()
+                     if entry.get("status") in DONE_STATUSES}
+
+        # 2. Check partition-level status (key = ex/stream/symbol/date); a non-DONE status settles the date
+        done_map = {}
+        for key, entry in self.state.get("partitions", {}).items():
+            date = key.rsplit('/', 1)[-1]
+            if date in completed or done_map.get(date) is False:
                 continue
-            status = entry.get("status")
-            date_map.setdefault(date, []).append(status)
-            
-        for date, statuses in date_map.items():
-            if all(s in ['success', 'quarantine', 'skipped'] for s in statuses):
-                completed.add(date)
-                
+            done_map[date] = entry.get("status") in DONE_STATUSES
+
+        completed |= {date for date, done in done_map.items() if done}
         return completed
 
     def plan_reverse(self) -> List[str]:
@@ -55,7 +48,8 @@ class BackfillPlanner:
 
     def plan_catch_up(self) -> List[str]:
         """Forward catch-up from last_compacted_date to today-1"""
-        last_date = self.state_manager.get_last_compacted_date()
+        # Derive from the already-loaded state instead of issuing another S3 GET
+        last_date = self.state.get('last_compacted_date')
         if not last_date:
             return []
             
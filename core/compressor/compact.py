@@ -5,26 +5,43 @@ Uses state-based catch-up and fast discovery.
 """
 
 import os
+import fcntl
+import shutil
 import tempfile
 import json
+import queue
 import socket
+import threading
 import uuid
+import multiprocessing.util
 from pathlib import Path
-from typing import List, Dict, Optional, Set, Tuple, Any, Callable
-from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Set, Tuple, Any, Callable, Iterable, Iterator
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 import logging
 import time
 import traceback
 
+# Return freed Arrow memory to the OS right away (jemalloc pool, zero decay) so RSS stays
+# bounded across partitions in long-running workers. The pool choice must be set before pyarrow
+# is imported; the decay is set through pyarrow below (Arrow's bundled jemalloc ignores MALLOC_CONF).
+os.environ.setdefault("ARROW_DEFAULT_MEMORY_POOL", "jemalloc")
+
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
 import pyarrow as pa
 import pyarrow.parquet as pq
 
+try:
+    pa.jemalloc_set_decay_ms(0)
+except NotImplementedError:
+    pass  # pyarrow built without jemalloc: the default pool is used as-is
+
 # Streaming k-way merge for bounded memory compaction
-from merge_writer import StreamingMergeWriter
+from merge_writer import StreamingMergeWriter, MERGE_OUTPUT_BUFFER_BYTES, shutdown_chunk_workers
 from quality_filter import QualityFilter, POST_FILTER_VERSION
 
 # Configure logging
@@ -39,7 +56,131 @@ logging.getLogger('urllib3').setLevel(logging.ERROR)
 logging.getLogger('botocore').setLevel(logging.ERROR)
 
 MAX_PARALLEL_DOWNLOADS = 50
+IO_POOL_WORKERS = max(MAX_PARALLEL_DOWNLOADS, 4 * (os.cpu_count() or 1))  # S3 transfers (I/O-bound)
+MERGE_POOL_WORKERS = os.cpu_count() or 1  # Concurrent merges (CPU-bound decode/encode)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # copyfileobj buffer for raw shard downloads
+DOWNLOAD_IN_FLIGHT = 2 * MAX_PARALLEL_DOWNLOADS  # Raw shard downloads queued per partition at once
+DISCOVERY_WORKERS = 32  # Concurrent LIST calls during prefix discovery
+LIST_PAGE_SIZE = 1000  # Keys per ListObjectsV2 page (S3 maximum)
+LIST_READ_AHEAD = 2  # LIST pages fetched ahead of the consumer
+RAM_STAGING_DIR = "/dev/shm"  # tmpfs: staged shards and merge output stay in memory
+RAM_STAGING_MAX_BYTES = 128 * 1024 * 1024  # Partitions up to this raw size are staged in RAM
+RANGED_GET_MIN_BYTES = 8 * 1024 * 1024  # Raw shards at least this large are fetched with parallel ranged GETs
+DOWNLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=RANGED_GET_MIN_BYTES,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True,
+)
+DOWNLOAD_CACHE_ETAGS_FILE = "_etags.json"  # {s3 key: ETag} sidecar per cached partition dir
+SINGLE_PUT_MAX_BYTES = 16 * 1024 * 1024  # Outputs up to this size are uploaded with one put_object
+# Larger outputs: parallel multipart upload (16 MiB parts, 16 in flight)
+UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=SINGLE_PUT_MAX_BYTES,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True,
+)
+LARGE_UPLOAD_MIN_BYTES = 1024 * 1024 * 1024  # Outputs at least this large use bigger parts, more in flight
+LARGE_UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=SINGLE_PUT_MAX_BYTES,
+    multipart_chunksize=64 * 1024 * 1024,
+    max_concurrency=32,  # stays well under S3_CLIENT_CONFIG.max_pool_connections
+    use_threads=True,
+)
 STATE_FILE_KEY = "compacted/_state.json"
+STATE_FLUSH_MAX_PENDING = 64  # Batched partition statuses flushed after this many...
+STATE_FLUSH_INTERVAL = 5.0  # ...or at least this often (seconds)
+LOCK_CLEANUP_GRACE_SECONDS = 120  # Locks younger than this are never treated as orphans
+STATE_LOCK_BACKENDS = ('s3', 'fcntl')  # s3: multi-host safe; fcntl: single-host only, no S3 round-trips
+
+def _utcnow_iso(now: Optional[datetime] = None) -> str:
+    """UTC timestamp as ISO-8601 with a Z suffix (the format stored in _state.json and lock bodies)"""
+    return (now or datetime.now(timezone.utc)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+# One pooled connection per concurrent caller (I/O pool + discovery fan-out), so threads never
+# queue on a socket or reconnect; adaptive retries back off client-side on S3 SlowDown.
+S3_CLIENT_CONFIG = Config(
+    max_pool_connections=max(100, IO_POOL_WORKERS + DISCOVERY_WORKERS),
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+)
+_s3_sessions: Dict[int, boto3.session.Session] = {}
+_s3_clients: Dict[Tuple[int, str, str, str], Any] = {}
+_s3_clients_lock = threading.Lock()
+
+def _s3_client(endpoint_url: str, access_key: str, secret_key: str):
+    """
+    Process-wide S3 client for a credential set.
+    Every job in the process shares one boto3 session and one warm connection pool per
+    credential set (raw and compact collapse to a single client when their keys match).
+    Keyed by pid so forked workers never reuse the parent's sockets.
+    """
+    pid = os.getpid()
+    cache_key = (pid, endpoint_url, access_key, secret_key)
+    with _s3_clients_lock:
+        client = _s3_clients.get(cache_key)
+        if client is None:
+            session = _s3_sessions.get(pid)
+            if session is None:
+                session = _s3_sessions[pid] = boto3.session.Session()
+            client = _s3_clients[cache_key] = session.client(
+                's3',
+                endpoint_url=endpoint_url,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                config=S3_CLIENT_CONFIG
+            )
+    return client
+
+def _read_ahead(pages: Iterable[Dict], depth: int = LIST_READ_AHEAD) -> Iterator[Dict]:
+    """Iterate LIST pages while a background thread already fetches the next ones"""
+    buf: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        """Queue item unless the consumer has stopped (never blocks on a full queue forever)"""
+        while not stop.is_set():
+            try:
+                buf.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+            put(end)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=produce, daemon=True, name='list-read-ahead').start()
+    try:
+        while True:
+            item = buf.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def _staging_dir(total_bytes: int, workers: int = 1) -> Optional[str]:
+    """tmpfs staging dir for small partitions, None (system temp dir) otherwise"""
+    try:
+        # Inputs + merged output + headroom must fit in the remaining tmpfs space. The check is
+        # not a reservation, so each of the `workers` processes sharing tmpfs gets 1/workers of it.
+        free = shutil.disk_usage(RAM_STAGING_DIR).free
+        if total_bytes <= RAM_STAGING_MAX_BYTES and free > 3 * total_bytes * max(1, workers):
+            return RAM_STAGING_DIR
+    except OSError:
+        pass
+    return None
 
 class Colors:
     GREEN = '\033[92m'
@@ -56,28 +197,101 @@ class Colors:
     def colorate(text, color):
         return f"{color}{text}{Colors.END}"
 
+@dataclass(frozen=True)
+class PartitionKeys:
+    """All S3 / state keys of one exchange/stream/symbol/date partition, built once per compaction"""
+    partition_key: str  # ex/stream/symbol/date (key under "partitions" in _state.json)
+    partition_prefix: str  # exchange=/stream=/symbol=/date=/ dir, same layout in raw and compact buckets
+    compact_key: str
+    meta_key: str
+    quality_key: str
+    lock_key: str
+
+    @classmethod
+    def build(cls, exchange: str, stream: str, symbol: str, date: str) -> 'PartitionKeys':
+        partition_key = f"{exchange}/{stream}/{symbol}/{date}"
+        prefix = f"exchange={exchange}/stream={stream}/symbol={symbol}/date={date}/"
+        return cls(
+            partition_key=partition_key,
+            partition_prefix=prefix,
+            compact_key=prefix + "data.parquet",
+            meta_key=prefix + "meta.json",
+            quality_key=prefix + "quality_day.json",
+            lock_key=f"compacted/locks/{partition_key}.lock",
+        )
+
 class StateManager:
     """Manages compaction state (_state.json) in S3"""
     
-    def __init__(self, s3_client, bucket: str, state_key: str = STATE_FILE_KEY):
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        state_key: str = STATE_FILE_KEY,
+        batch_updates: bool = False,
+        lock_backend: str = 's3'
+    ):
+        if lock_backend not in STATE_LOCK_BACKENDS:
+            raise ValueError(f"Unknown state lock backend: {lock_backend}")
         self.s3_client = s3_client
         self.bucket = bucket
         self.state_key = state_key
         # Serialize updates to the shared state document across multiple workers/processes.
         # Without this, parallel workers can clobber each other's writes (last-write-wins).
         self.state_lock_key = f"{state_key}.lock"
+        # S3 conditional-PUT locks cost 2-3 round-trips per update (and poll under contention).
+        # When every writer runs on this host, an flock on a local file serializes them instead.
+        self.lock_backend = lock_backend
+        self.local_lock_path = os.path.join(
+            tempfile.gettempdir(), "quantlab-" + state_key.replace("/", "_") + ".lock"
+        )
+        self._local_lock_fd: Optional[int] = None
+        # hostname/pid stamped into lock bodies; resolved once (re-resolved only in a forked child)
+        self._hostname = socket.gethostname()
+        self._identity: Dict[str, Any] = {"hostname": self._hostname, "pid": os.getpid()}
+        self._local_lock_pid: Optional[int] = None
+        self._local_thread_lock = threading.Lock()
+        # Last state document seen by this process (read or written); memoizes get_last_compacted_date.
+        self._cached_state: Optional[Dict] = None
+        # ETag of _cached_state in S3; lets _read_state revalidate with a body-less conditional GET.
+        self._state_etag: Optional[str] = None
+        self._partitions_index: Dict[str, Dict] = {}
+
+        # Batched mode: terminal partition statuses are queued (last write per partition wins)
+        # and flushed in one locked read-modify-write instead of one per partition.
+        # in_progress stays synchronous so other runners' stale-lock cleanup sees active work.
+        self.batch_updates = batch_updates
+        self._pending: Dict[str, Dict] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_flushing = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+        self._flush_finalizer: Optional[multiprocessing.util.Finalize] = None
+        if batch_updates:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True, name='state-flush')
+            self._flush_thread.start()
+            # Runs at interpreter exit and when a multiprocessing worker shuts down (unless closed)
+            self._flush_finalizer = multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def _worker_identity(self) -> Dict[str, Any]:
+        """hostname/pid fragment for lock bodies"""
+        if self._identity["pid"] != os.getpid():
+            self._identity = {"hostname": self._hostname, "pid": os.getpid()}
+        return self._identity
 
     def _acquire_state_lock(self, wait_seconds: float = 30.0, ttl_seconds: float = 120.0) -> Optional[str]:
         """
         Acquire a best-effort distributed lock for state updates using S3 conditional put.
         Returns a lock token if acquired, or None if lock couldn't be acquired (caller may fallback).
         """
+        if self.lock_backend == 'fcntl':
+            return self._acquire_local_lock()
+
         token = str(uuid.uuid4())
         body = {
             "token": token,
-            "hostname": socket.gethostname(),
-            "pid": os.getpid(),
-            "started_at": datetime.utcnow().isoformat() + "Z",
+            **self._worker_identity(),
+            "started_at": _utcnow_iso(),
         }
 
         deadline = time.time() + wait_seconds
@@ -86,7 +300,7 @@ class StateManager:
                 self.s3_client.put_object(
                     Bucket=self.bucket,
                     Key=self.state_lock_key,
-                    Body=json.dumps(body).encode("utf-8"),
+                    Body=json.dumps(body, separators=(",", ":")).encode("utf-8"),
                     IfNoneMatch="*",
                     ContentType="application/json",
                 )
@@ -98,11 +312,13 @@ class StateManager:
                 # Lock exists; if it's stale, break it.
                 try:
                     resp = self.s3_client.get_object(Bucket=self.bucket, Key=self.state_lock_key)
-                    data = json.loads(resp["Body"].read().decode("utf-8") or "{}")
+                    data = json.loads(resp["Body"].read() or b"{}")
                     started_at_str = (data.get("started_at") or "").replace("Z", "+00:00")
                     if started_at_str:
-                        started_at = datetime.fromisoformat(started_at_str).replace(tzinfo=None)
-                        if started_at < (datetime.utcnow() - timedelta(seconds=ttl_seconds)):
+                        started_at = datetime.fromisoformat(started_at_str)
+                        if started_at.tzinfo is None:
+                            started_at = started_at.replace(tzinfo=timezone.utc)
+                        if started_at < (datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)):
                             logger.warning(
                                 f"State lock stale (> {ttl_seconds}s). Forcing unlock: {self.state_lock_key}"
                             )
@@ -118,9 +334,13 @@ class StateManager:
 
     def _release_state_lock(self, token: str):
         """Release state lock if we still own it."""
+        if self.lock_backend == 'fcntl':
+            self._release_local_lock()
+            return
+
         try:
             resp = self.s3_client.get_object(Bucket=self.bucket, Key=self.state_lock_key)
-            data = json.loads(resp["Body"].read().decode("utf-8") or "{}")
+            data = json.loads(resp["Body"].read() or b"{}")
             if data.get("token") != token:
                 return
         except ClientError as e:
@@ -135,6 +355,26 @@ class StateManager:
         except Exception:
             pass
 
+    def _acquire_local_lock(self) -> str:
+        # flock is per open file description: open once per process (not inherited across fork),
+        # and hold a thread lock too since threads share the description.
+        self._local_thread_lock.acquire()
+        try:
+            if self._local_lock_pid != os.getpid():
+                self._local_lock_fd = os.open(self.local_lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._local_lock_pid = os.getpid()
+            fcntl.flock(self._local_lock_fd, fcntl.LOCK_EX)
+        except Exception:
+            self._local_thread_lock.release()
+            raise
+        return "fcntl"
+
+    def _release_local_lock(self):
+        try:
+            fcntl.flock(self._local_lock_fd, fcntl.LOCK_UN)
+        finally:
+            self._local_thread_lock.release()
+
     def _update_state(self, mutate_fn):
         """
         Read-modify-write state with a best-effort distributed lock.
@@ -142,23 +382,21 @@ class StateManager:
         """
         token = self._acquire_state_lock()
         try:
-            state = self._read_state()
+            state = self._read_state_for_update()
             mutate_fn(state)
-            self.s3_client.put_object(
-                Bucket=self.bucket,
-                Key=self.state_key,
-                Body=json.dumps(state, indent=2).encode("utf-8"),
-                ContentType="application/json",
-            )
+            self._put_state(state)
         finally:
             if token:
                 self._release_state_lock(token)
         
     def get_last_compacted_date(self) -> Optional[str]:
-        """Read last_compacted_date from S3"""
+        """Read last_compacted_date from S3 (memoized; refreshed by any state read/write)"""
+        if self._cached_state is not None:
+            return self._cached_state.get('last_compacted_date')
         try:
             resp = self.s3_client.get_object(Bucket=self.bucket, Key=self.state_key)
-            state = json.loads(resp['Body'].read().decode('utf-8'))
+            state = json.loads(resp['Body'].read())
+            self._remember_state(state, resp.get('ETag'))
             return state.get('last_compacted_date')
         except ClientError as e:
             if e.response['Error']['Code'] == 'NoSuchKey':
@@ -170,66 +408,117 @@ class StateManager:
             
     def update_last_compacted_date(self, date_str: str):
         """Update last_compacted_date and current timestamp in S3 for audit"""
+        updated_at = _utcnow_iso()
+
         def mutate(state: Dict):
             state["last_compacted_date"] = date_str
-            state["updated_at"] = datetime.utcnow().isoformat() + "Z"
+            state["updated_at"] = updated_at
 
         self._update_state(mutate)
         logger.info(f"Updated state: last_compacted_date={date_str}")
         
-    def log_partition_status(self, result: Dict, status: Optional[str] = None):
+    def log_partition_status(self, keys: PartitionKeys, result: Dict, status: Optional[str] = None):
         """Log individual partition results into state history"""
+        key = keys.partition_key
+        final_status = status or result.get("status", "unknown")
+
+        entry = {
+            "status": final_status,
+            "day_quality_post": result.get("day_quality"),
+            "post_filter_version": result.get("post_filter_version", "1.0.0"),
+            "rows": result.get("rows", 0),
+            "total_size_bytes": result.get("total_size_bytes", 0),
+            "updated_at": _utcnow_iso(),
+        }
+
+        # Persist minimal diagnostics to prevent re-work and aid triage.
+        if result.get("error_type"):
+            entry["error_type"] = result.get("error_type")
+        if result.get("failing_key"):
+            entry["failing_key"] = result.get("failing_key")
+        if result.get("error"):
+            entry["error"] = str(result.get("error"))[:2000]
+
+        if self.batch_updates and final_status != "in_progress":
+            with self._pending_lock:
+                self._pending[key] = entry
+                full = len(self._pending) >= STATE_FLUSH_MAX_PENDING
+            if full:
+                self.flush()
+            return
+
         def mutate(state: Dict):
             if "partitions" not in state:
                 state["partitions"] = {}
+            state["partitions"][key] = entry
 
-            key = f"{result['exchange']}/{result['stream']}/{result['symbol']}/{result['date']}"
-            final_status = status or result.get("status", "unknown")
-
-            entry = {
-                "status": final_status,
-                "day_quality_post": result.get("day_quality"),
-                "post_filter_version": result.get("post_filter_version", "1.0.0"),
-                "rows": result.get("rows", 0),
-                "total_size_bytes": result.get("total_size_bytes", 0),
-                "updated_at": datetime.utcnow().isoformat() + "Z",
-            }
-
-            # Persist minimal diagnostics to prevent re-work and aid triage.
-            if result.get("error_type"):
-                entry["error_type"] = result.get("error_type")
-            if result.get("failing_key"):
-                entry["failing_key"] = result.get("failing_key")
-            if result.get("error"):
-                entry["error"] = str(result.get("error"))[:2000]
+        with self._flush_lock:
+            # This write supersedes any queued status for the same partition
+            with self._pending_lock:
+                self._pending.pop(key, None)
+            self._update_state(mutate)
+
+    def flush(self):
+        """Write all queued partition statuses in a single state update"""
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
 
-            state["partitions"][key] = entry
+            def mutate(state: Dict):
+                state.setdefault("partitions", {}).update(pending)
 
-        self._update_state(mutate)
+            try:
+                self._update_state(mutate)
+            except Exception as e:
+                logger.error(f"State flush failed ({len(pending)} partitions), will retry: {e}")
+                with self._pending_lock:
+                    for key, entry in pending.items():
+                        self._pending.setdefault(key, entry)
+
+    def _flush_loop(self):
+        while not self._stop_flushing.wait(STATE_FLUSH_INTERVAL):
+            self.flush()
+
+    def close(self):
+        """Stop the background flush thread and write all queued statuses"""
+        self._stop_flushing.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+            self._flush_thread = None
+        self.flush()
+        with self._pending_lock:
+            flushed = not self._pending
+        if flushed and self._flush_finalizer is not None:
+            # Nothing left for the exit-time flush; drop it so this manager can be collected
+            self._flush_finalizer.cancel()
+            self._flush_finalizer = None
 
     def log_day_status(self, date: str, status: str):
         """Log day-level status (useful for skipping BAD days entirely)"""
+        day_entry = {
+            "status": status,
+            "updated_at": _utcnow_iso(),
+        }
+
         def mutate(state: Dict):
             if "days" not in state:
                 state["days"] = {}
 
-            state["days"][date] = {
-                "status": status,
-                "updated_at": datetime.utcnow().isoformat() + "Z",
-            }
+            state["days"][date] = day_entry
 
         self._update_state(mutate)
 
-    def acquire_lock(self, result: Dict) -> bool:
+    def acquire_lock(self, keys: PartitionKeys) -> bool:
         """
         Attempt to acquire an atomic lock for a partition.
         Uses S3 If-None-Match: "*" for atomicity.
         """
-        key = f"compacted/locks/{result['exchange']}/{result['stream']}/{result['symbol']}/{result['date']}.lock"
+        key = keys.lock_key
         lock_body = {
-            "hostname": socket.gethostname(),
-            "pid": os.getpid(),
-            "started_at": datetime.utcnow().isoformat() + "Z",
+            **self._worker_identity(),
+            "started_at": _utcnow_iso(),
             "version": "1.1.0"
         }
         
@@ -237,7 +526,7 @@ class StateManager:
             self.s3_client.put_object(
                 Bucket=self.bucket,
                 Key=key,
-                Body=json.dumps(lock_body).encode('utf-8'),
+                Body=json.dumps(lock_body, separators=(',', ':')).encode('utf-8'),
                 IfNoneMatch='*',
                 ContentType='application/json'
             )
@@ -250,9 +539,9 @@ class StateManager:
             logger.error(f"Error acquired lock for {key}: {e}")
             return False
 
-    def release_lock(self, result: Dict):
+    def release_lock(self, keys: PartitionKeys):
         """Release the partition lock."""
-        key = f"compacted/locks/{result['exchange']}/{result['stream']}/{result['symbol']}/{result['date']}.lock"
+        key = keys.lock_key
         try:
             self.s3_client.delete_object(Bucket=self.bucket, Key=key)
         except Exception as e:
@@ -261,81 +550,82 @@ class StateManager:
     def cleanup_stale_locks(self, target_date: str = None):
         """
         Clear stale locks. 
-        TTL: 2 hours.
+        TTL: 2 hours (lock age = the lock object's LastModified, straight from the listing).
         Logic:
-        1. List all locks in S3.
-        2. If lock exists but state NOT in_progress -> remove lock.
-        3. If state in_progress but updated_at > 2h -> set aborted/stalled + remove lock.
+        1. List all locks in S3 (every page).
+        2. If lock exists but state NOT in_progress -> remove lock (after a short grace period,
+           so a lock whose in_progress status is still being written is not mistaken for an orphan).
+        3. If state in_progress but lock older than 2h -> set stalled + remove lock.
+        Stale locks are removed with batched delete_objects calls.
         """
         prefix = "compacted/locks/"
         token = self._acquire_state_lock()
         try:
-            state = self._read_state()
+            state = self._read_state_for_update()
             partitions = state.get("partitions", {})
 
-            resp = self.s3_client.list_objects_v2(Bucket=self.bucket, Prefix=prefix)
-            locks = resp.get("Contents", [])
-
-            now = datetime.utcnow()
+            now = datetime.now(timezone.utc)
             ttl_limit = now - timedelta(hours=2)
+            grace_limit = now - timedelta(seconds=LOCK_CLEANUP_GRACE_SECONDS)
             changed = False
+            stale_keys = []
+
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(
+                Bucket=self.bucket, Prefix=prefix, PaginationConfig={'PageSize': LIST_PAGE_SIZE}
+            ):
+                for l in page.get("Contents", []):
+                    lock_key = l["Key"]
+                    # compacted/locks/exchange/stream/symbol/date.lock
+                    rel_path = lock_key[len(prefix):].replace(".lock", "")
+                    parts = rel_path.split("/")
+                    if len(parts) != 4:
+                        continue
+
+                    p_date = parts[3]
+                    if target_date and p_date != target_date:
+                        continue
+
+                    entry = partitions.get(rel_path)
+                    locked_at = l["LastModified"]
+
+                    if not entry or entry.get("status") != "in_progress":
+                        if locked_at >= grace_limit:
+                            continue
+                        trigger_reason = f"Status is {entry.get('status') if entry else 'missing'}"
+                    elif locked_at < ttl_limit:
+                        trigger_reason = f"Progress STALLED since {locked_at.isoformat()}"
+                        entry["status"] = "stalled"
+                        entry["updated_at"] = _utcnow_iso(now)
+                        changed = True
+                    else:
+                        continue
 
-            for l in locks:
-                lock_key = l["Key"]
-                # compacted/locks/exchange/stream/symbol/date.lock
-                rel_path = lock_key.replace(prefix, "").replace(".lock", "")
-                parts = rel_path.split("/")
-                if len(parts) != 4:
-                    continue
-
-                p_date = parts[3]
-                if target_date and p_date != target_date:
-                    continue
-
-                p_key = rel_path
-                entry = partitions.get(p_key)
-
-                lock_stale = False
-                trigger_reason = ""
-
-                if not entry or entry.get("status") != "in_progress":
-                    lock_stale = True
-                    trigger_reason = f"Status is {entry.get('status') if entry else 'missing'}"
-                else:
-                    updated_at_str = entry.get("updated_at", "").replace("Z", "+00:00")
-                    try:
-                        updated_at = datetime.fromisoformat(updated_at_str).replace(tzinfo=None)
-                        if updated_at < ttl_limit:
-                            lock_stale = True
-                            trigger_reason = f"Progress STALLED since {updated_at_str}"
-                            entry["status"] = "stalled"
-                            entry["updated_at"] = now.isoformat() + "Z"
-                            changed = True
-                    except Exception:
-                        pass
-
-                if lock_stale:
                     logger.warning(f"Cleanup: Removing stale lock {lock_key} | {trigger_reason}")
-                    self.s3_client.delete_object(Bucket=self.bucket, Key=lock_key)
+                    stale_keys.append(lock_key)
 
-            if changed:
-                self.s3_client.put_object(
+            for i in range(0, len(stale_keys), 1000):
+                self.s3_client.delete_objects(
                     Bucket=self.bucket,
-                    Key=self.state_key,
-                    Body=json.dumps(state, indent=2).encode("utf-8"),
-                    ContentType="application/json",
+                    Delete={'Objects': [{'Key': k} for k in stale_keys[i:i + 1000]], 'Quiet': True},
                 )
+
+            if changed:
+                self._put_state(state)
         except Exception as e:
             logger.error(f"Error during stale lock cleanup: {e}")
         finally:
             if token:
                 self._release_state_lock(token)
 
-    def get_partition_status(self, result: Dict) -> Tuple[Optional[str], Optional[datetime]]:
+    def get_partition_status(self, keys: PartitionKeys) -> Tuple[Optional[str], Optional[datetime]]:
         """Get current status and timestamp for a partition"""
-        state = self._read_state()
-        key = f"{result['exchange']}/{result['stream']}/{result['symbol']}/{result['date']}"
-        entry = state.get("partitions", {}).get(key)
+        key = keys.partition_key
+        with self._pending_lock:
+            entry = self._pending.get(key)
+        if entry is None:
+            self._read_state()  # revalidates the cached document and its index
+            entry = self._partitions_index.get(key)
         if not entry:
             return None, None
         
@@ -349,13 +639,50 @@ class StateManager:
 
 
     def _read_state(self) -> Dict:
-        """Helper to read full state or return empty"""
+        """Helper to read full state or return empty (conditional GET: 304 reuses the cached copy)"""
         try:
-            resp = self.s3_client.get_object(Bucket=self.bucket, Key=self.state_key)
-            return json.loads(resp['Body'].read().decode('utf-8'))
+            if self._state_etag and self._cached_state is not None:
+                resp = self.s3_client.get_object(
+                    Bucket=self.bucket, Key=self.state_key, IfNoneMatch=self._state_etag
+                )
+            else:
+                resp = self.s3_client.get_object(Bucket=self.bucket, Key=self.state_key)
+            state = json.loads(resp['Body'].read())
+            self._remember_state(state, resp.get('ETag'))
+            return state
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['304', 'NotModified']:
+                return self._cached_state
+            self._partitions_index = {}
+            return {}
         except:
+            self._partitions_index = {}
             return {}
 
+    def _read_state_for_update(self) -> Dict:
+        """_read_state for callers that mutate the result in place"""
+        state = self._read_state()
+        # The cached dict is about to diverge from S3 until _put_state succeeds; forget its ETag
+        # so a failed write can't be served back as "unchanged" by the next conditional GET.
+        self._state_etag = None
+        return state
+
+    def _put_state(self, state: Dict):
+        """Write the full state document and remember it (with its ETag) as the cached copy"""
+        resp = self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.state_key,
+            Body=json.dumps(state, separators=(',', ':')).encode("utf-8"),
+            ContentType="application/json",
+        )
+        self._remember_state(state, resp.get('ETag'))
+
+    def _remember_state(self, state: Dict, etag: Optional[str]):
+        self._cached_state = state
+        self._state_etag = etag
+        # Flat partition-key -> entry view of the cached document for status lookups
+        self._partitions_index = state.get("partitions") or {}
+
 
 class CompactionJob:
     """Handles compaction of parquet files from raw to compact bucket"""
@@ -369,43 +696,53 @@ class CompactionJob:
         compact_secret_key: str,
         raw_bucket: str,
         compact_bucket: str,
-        state_key: str = STATE_FILE_KEY
+        state_key: str = STATE_FILE_KEY,
+        batch_state_updates: bool = False,
+        state_lock_backend: str = 's3',
+        download_cache_dir: Optional[str] = None,
+        staging_workers: int = 1,
+        merge_chunk_workers: int = 1
     ):
-        config = Config(max_pool_connections=100)
         # Client for reading raw data
-        self.s3_client_raw = boto3.client(
-            's3',
-            endpoint_url=s3_endpoint,
-            aws_access_key_id=raw_access_key,
-            aws_secret_access_key=raw_secret_key,
-            config=config
-        )
+        self.s3_client_raw = _s3_client(s3_endpoint, raw_access_key, raw_secret_key)
         # Client for writing compact data and managing state
-        self.s3_client_compact = boto3.client(
-            's3',
-            endpoint_url=s3_endpoint,
-            aws_access_key_id=compact_access_key,
-            aws_secret_access_key=compact_secret_key,
-            config=config
-        )
+        self.s3_client_compact = _s3_client(s3_endpoint, compact_access_key, compact_secret_key)
         self.raw_bucket = raw_bucket
         self.compact_bucket = compact_bucket
         # State and outputs go to compact bucket
-        self.state_manager = StateManager(self.s3_client_compact, self.compact_bucket, state_key=state_key)
+        self.state_manager = StateManager(
+            self.s3_client_compact, self.compact_bucket, state_key=state_key,
+            batch_updates=batch_state_updates, lock_backend=state_lock_backend
+        )
+        # Shutdown check callback (can be set by caller)
         self.check_shutdown = lambda: False
         
         # Diagnostics mapping
         self._path_to_s3_key = {}
-        # State and outputs go to compact bucket
-        self.state_manager = StateManager(self.s3_client_compact, compact_bucket, state_key=state_key)
-        
-        # Shutdown check callback (can be set by caller)
-        self.check_shutdown = lambda: False
+        # Persistent raw-shard cache (None: shards live only in the partition's temp dir)
+        self.download_cache_dir = Path(download_cache_dir) if download_cache_dir else None
+        # Worker processes sharing the tmpfs staging dir (splits its free space)
+        self.staging_workers = staging_workers
+        # Processes per hierarchical merge (partitions over MAX_OPEN_FILES shards); 1 = in-process
+        self.merge_chunk_workers = merge_chunk_workers
+        # Artifact keys confirmed present via LIST (entries are discarded when an artifact is deleted)
+        self._exists_cache: Set[str] = set()
+        # Separate pools so CPU-bound merges never compete with S3 transfers for workers when
+        # compact_date_partition is driven from several threads (threads spawned on demand)
+        self._io_pool = ThreadPoolExecutor(max_workers=IO_POOL_WORKERS, thread_name_prefix='s3-io')
+        self._cpu_pool = ThreadPoolExecutor(max_workers=MERGE_POOL_WORKERS, thread_name_prefix='merge')
         
         # For backward compatibility within the class methods, we use aliases
         # but we should ideally update methods to be explicit.
         # Actually, let's update the methods for clarity.
         
+    def close(self):
+        """Write queued state and stop the job's threads and chunk processes (job unusable afterwards)"""
+        self.state_manager.close()
+        self._io_pool.shutdown()
+        self._cpu_pool.shutdown()
+        shutdown_chunk_workers()
+
     def compact_date_partition(
         self,
         exchange: str,
@@ -425,14 +762,10 @@ class CompactionJob:
         }
 
         # Derive keys early so we can reconcile state vs. artifacts before doing any work.
-        raw_prefix = f"exchange={exchange}/stream={stream}/symbol={symbol}/date={date}/"
-        compact_key = f"exchange={exchange}/stream={stream}/symbol={symbol}/date={date}/data.parquet"
-        meta_key = f"exchange={exchange}/stream={stream}/symbol={symbol}/date={date}/meta.json"
-        quality_key = f"exchange={exchange}/stream={stream}/symbol={symbol}/date={date}/quality_day.json"
-        lock_key = f"compacted/locks/{exchange}/{stream}/{symbol}/{date}.lock"
+        keys = PartitionKeys.build(exchange, stream, symbol, date)
         
         # 1. State Check
-        current_status, _ = self.state_manager.get_partition_status(result)
+        current_status, _ = self.state_manager.get_partition_status(keys)
         if current_status == 'success' and not overwrite:
             result['status'] = 'skipped'
             return result
@@ -448,25 +781,26 @@ class CompactionJob:
         # treat as done and update state so the planner won't keep re-scheduling the same partition/day.
         if not overwrite and current_status in [None, 'in_progress', 'stalled']:
             try:
-                lock_exists = self._compact_exists(lock_key)
+                lock_exists = self._compact_exists(keys.lock_key)
             except Exception:
                 lock_exists = True  # Conservative: assume active lock on errors
 
             if not lock_exists:
+                artifacts = (keys.compact_key, keys.meta_key, keys.quality_key)
                 try:
-                    artifacts_exist = (
-                        self._compact_exists(compact_key)
-                        and self._compact_exists(meta_key)
-                        and self._compact_exists(quality_key)
-                    )
+                    # One LIST of the compact partition dir instead of a HEAD per artifact
+                    if not self._exists_cache.issuperset(artifacts):
+                        present = self._list_compact_partition_keys(keys.partition_prefix)
+                        self._exists_cache.update(k for k in artifacts if k in present)
+                    artifacts_exist = self._exists_cache.issuperset(artifacts)
                 except Exception:
                     artifacts_exist = False
 
                 if artifacts_exist:
                     meta = {}
                     try:
-                        resp = self.s3_client_compact.get_object(Bucket=self.compact_bucket, Key=meta_key)
-                        meta = json.loads(resp['Body'].read().decode('utf-8') or '{}')
+                        resp = self.s3_client_compact.get_object(Bucket=self.compact_bucket, Key=keys.meta_key)
+                        meta = json.loads(resp['Body'].read() or b'{}')
                     except Exception:
                         pass
 
@@ -483,7 +817,7 @@ class CompactionJob:
                         'error': None,
                     }
                     try:
-                        self.state_manager.log_partition_status(healed, status='success')
+                        self.state_manager.log_partition_status(keys, healed, status='success')
                     except Exception:
                         pass
 
@@ -494,15 +828,16 @@ class CompactionJob:
                     return result
             
         # 2. Atomic S3 LOCK acquisition
-        if not self.state_manager.acquire_lock(result):
+        if not self.state_manager.acquire_lock(keys):
             logger.info(Colors.colorate(f"SKIP {symbol} {date} | Locked by other worker", Colors.BLUE))
             result['status'] = 'locked'
             return result
 
+        local_files = []
         try:
             raw_files = []
             # 3. Mark as in-progress immediately after lock
-            self.state_manager.log_partition_status(result, status='in_progress')
+            self.state_manager.log_partition_status(keys, result, status='in_progress')
 
             # 2. Quality Gating
             t_quality = time.perf_counter()
@@ -512,7 +847,7 @@ class CompactionJob:
             
             if result['day_quality'] == 'BAD':
                 result['status'] = 'quarantine'
-                self.state_manager.log_partition_status(result)
+                self.state_manager.log_partition_status(keys, result)
                 q_tag = Colors.colorate("[BAD]", Colors.RED)
                 st_tag = Colors.colorate("[QUARANTINE]", Colors.YELLOW)
                 logger.warning(f"{st_tag} {symbol} {stream} {date} | {q_tag} day quality")
@@ -521,7 +856,7 @@ class CompactionJob:
             if result['day_quality'] == 'PARTIAL':
                 result['status'] = 'skipped'
                 result['error'] = 'Partial day data, retry expected'
-                self.state_manager.log_partition_status(result)
+                self.state_manager.log_partition_status(keys, result)
                 q_tag = Colors.colorate("[PARTIAL]", Colors.BLUE)
                 st_tag = Colors.colorate("[SKIP]", Colors.BLUE)
                 logger.info(f"{st_tag} {symbol} {stream} {date} | {q_tag} (waiting for more data)")
@@ -529,26 +864,27 @@ class CompactionJob:
             
             # 3. Compaction
             t0 = time.perf_counter()
-            raw_files = self._list_raw_files(raw_prefix)
+            raw_files = self._list_raw_files(keys.partition_prefix)
             result['t_list'] = time.perf_counter() - t0
             
             if not raw_files:
                 result['status'] = 'no_files'
-                self.state_manager.log_partition_status(result)
+                self.state_manager.log_partition_status(keys, result)
                 return result
             
             result['files_processed'] = len(raw_files)
             result['total_size_bytes'] = sum(f['size'] for f in raw_files)
             
-            with tempfile.TemporaryDirectory() as temp_dir:
+            with tempfile.TemporaryDirectory(dir=_staging_dir(result['total_size_bytes'], self.staging_workers)) as temp_dir:
                 t_down = time.perf_counter()
                 local_files = self._download_files(raw_files, temp_dir, symbol, date)
                 result['t_download'] = time.perf_counter() - t_down
                 
-                if not local_files:
+                if len(local_files) != len(raw_files):
+                    # Never merge a partial shard set (e.g. ENOSPC on a full staging dir)
                     result['status'] = 'download_failed'
-                    result['error'] = 'No files downloaded'
-                    self.state_manager.log_partition_status(result)
+                    result['error'] = f"Downloaded {len(local_files)}/{len(raw_files)} files"
+                    self.state_manager.log_partition_status(keys, result)
                     return result
                 
                 output_path = Path(temp_dir) / 'data.parquet'
@@ -563,19 +899,13 @@ class CompactionJob:
                         result[f't_merge_{k}'] = v
                 
                 result['rows'] = metadata['rows']
-                result['output_size_bytes'] = output_path.stat().st_size
+                result['output_size_bytes'] = metadata.get('output_bytes') or output_path.stat().st_size
                 
                 # POST-WRITE VERIFICATION: Read back before upload
                 t_verify = time.perf_counter()
                 self._verify_output_integrity(output_path, metadata['rows'])
                 result['t_verify'] = time.perf_counter() - t_verify
                 
-                # ATOMIC UPLOAD sequence
-                t_up = time.perf_counter()
-                # All files uploaded with .tmp first
-                self._upload_to_s3(output_path, compact_key + ".tmp")
-                result['t_upload_data'] = time.perf_counter() - t_up
-                
                 meta_content = {
                     "rows": metadata['rows'],
                     "ts_event_min": metadata['ts_event_min'],
@@ -588,15 +918,32 @@ class CompactionJob:
                     "day_quality": result['day_quality'],
                     "post_filter_version": POST_FILTER_VERSION
                 }
-                self._upload_json_to_s3(meta_content, meta_key + ".tmp")
-                self._upload_json_to_s3(quality_report, quality_key + ".tmp")
                 
-                # Finalize: Promotion via copy+delete
-                self._finalize_artifacts([compact_key, meta_key, quality_key])
+                # COMMIT-ORDERED UPLOAD sequence: meta.json is the completion marker (the heal path
+                # requires it), so it is written only after data + quality have landed.
+                # A meta.json left by an earlier run (--overwrite, quarantine retry, stalled redo)
+                # is deleted first so it can never describe the new data.parquet before commit.
+                t_up = time.perf_counter()
+                self.s3_client_compact.delete_object(Bucket=self.compact_bucket, Key=keys.meta_key)
+                self._exists_cache.discard(keys.meta_key)
+                self._upload_parallel([
+                    (self._upload_to_s3, (output_path, keys.compact_key)),
+                    (self._upload_json_to_s3, (quality_report, keys.quality_key)),
+                ])
+                result['t_upload_data'] = time.perf_counter() - t_up
+                
+                # Commit (skipped on shutdown: without meta.json the partition is simply redone)
+                if self.check_shutdown(): raise InterruptedError()
+                self._upload_json_to_s3(meta_content, keys.meta_key)
                 result['upload_time'] = time.perf_counter() - t_up
+
+            if self.download_cache_dir:
+                # Committed: only failed or interrupted partitions keep their shards for the
+                # retry, so the cache never grows into a mirror of the raw bucket
+                shutil.rmtree(self.download_cache_dir / keys.partition_prefix, ignore_errors=True)
                 
             result['status'] = 'success'
-            self.state_manager.log_partition_status(result)
+            self.state_manager.log_partition_status(keys, result)
             
             # Requested: [SUCCESS] symbol stream date | files_in=N | rows=... | merge=..s | up=..s
             s_tag = Colors.colorate("[SUCCESS]", Colors.GREEN)
@@ -608,7 +955,7 @@ class CompactionJob:
             result['status'] = 'aborted'
             result['error'] = 'Shutdown requested'
             logger.warning(Colors.colorate(f"UPLOAD SKIPPED due to shutdown: {symbol} {date}", Colors.RED))
-            self.state_manager.log_partition_status(result, status='aborted')
+            self.state_manager.log_partition_status(keys, result, status='aborted')
             return result
             
         except Exception as e:
@@ -662,18 +1009,24 @@ class CompactionJob:
             logger.error(f"  -> MSG: {msg}")
             
             try:
-                self.state_manager.log_partition_status(result, status='quarantine')
+                self.state_manager.log_partition_status(keys, result, status='quarantine')
             except:
                 pass
             return result
         
         finally:
-            # 4. RELEASE LOCK after terminal state is committed
-            self.state_manager.release_lock(result)
+            # 4. RELEASE LOCK after terminal state is committed. In batched mode the status may
+            # still be queued: flush non-success ones first, or another host would see in_progress
+            # without a lock and redo the partition. (A queued success is safe to leave for the
+            # next flush: meta.json exists, so the heal path already records it as success.)
+            if self.state_manager.batch_updates and result.get('status') != 'success':
+                self.state_manager.flush()
+            self.state_manager.release_lock(keys)
             
         return result
     
     def _compact_exists(self, key: str) -> bool:
+        """HEAD a compact-bucket key."""
         try:
             self.s3_client_compact.head_object(Bucket=self.compact_bucket, Key=key)
             return True
@@ -682,49 +1035,143 @@ class CompactionJob:
                 return False
             raise
     
+    def _list_compact_partition_keys(self, prefix: str) -> Set[str]:
+        """All compact-bucket keys directly under a partition prefix (a single LIST page)"""
+        resp = self.s3_client_compact.list_objects_v2(Bucket=self.compact_bucket, Prefix=prefix)
+        return {obj['Key'] for obj in resp.get('Contents', [])}
+    
     def _list_raw_files(self, prefix: str) -> List[Dict]:
         """List files for a specific partition (date-bounded)"""
         files = []
         paginator = self.s3_client_raw.get_paginator('list_objects_v2')
-        for page in paginator.paginate(Bucket=self.raw_bucket, Prefix=prefix):
-            if 'Contents' not in page:
-                continue
-            for obj in page['Contents']:
-                key = obj['Key']
-                if not key.endswith('.parquet') or '/._' in key or key.split('/')[-1].startswith('._'):
-                    continue
-                files.append({'key': key, 'size': obj['Size']})
+        pages = paginator.paginate(
+            Bucket=self.raw_bucket, Prefix=prefix, PaginationConfig={'PageSize': LIST_PAGE_SIZE}
+        )
+        # Next page's request overlaps with filtering the current one
+        for page in _read_ahead(pages):
+            # prefix ends in '/', so '/._' also covers AppleDouble basenames ('._*')
+            files.extend(
+                {'key': obj['Key'], 'size': obj['Size'], 'etag': obj.get('ETag')}
+                for obj in page.get('Contents', ())
+                if obj['Key'].endswith('.parquet') and '/._' not in obj['Key']
+            )
         return files
     
     def _download_files(self, files: List[Dict], download_dir: str, symbol: str, date: str) -> List[Path]:
-        local_files = []
+        # Slot per input so results keep listing order without sorting afterwards
+        local_files: List[Optional[Path]] = [None] * len(files)
         download_path = Path(download_dir)
+        # Fixed-width idx prefix: StreamingMergeWriter sorts inputs by path, so names must sort
+        # in listing order (unpadded past 10,000 shards, "10000_" would sort before "1000_")
+        idx_width = max(4, len(str(len(files))))
         self._path_to_s3_key = {}  # Reset for this partition
         
-        def download_file(idx: int, key: str) -> Optional[Path]:
+        # Re-runs/retries reuse cached shards whose size and listing ETag still match
+        cache_path = etags_path = None
+        cached_etags: Dict[str, str] = {}
+        if self.download_cache_dir and files:
+            cache_path = self.download_cache_dir
+            partition_dir = os.path.commonpath([str(Path(f['key']).parent) for f in files])
+            etags_path = cache_path / partition_dir / DOWNLOAD_CACHE_ETAGS_FILE
+            try:
+                etags_path.parent.mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                # Unwritable or full cache dir: the partition is still compacted, just uncached
+                logger.warning(f"Download cache unavailable ({e}), downloading {partition_dir} uncached")
+                cache_path = etags_path = None
+            if etags_path is not None:
+                try:
+                    cached_etags = json.loads(etags_path.read_bytes())
+                except (OSError, ValueError):
+                    cached_etags = {}
+        fetched_etags: Dict[str, str] = {}
+        
+        def download_file(idx: int, key: str, size: int, etag: Optional[str]) -> Optional[Path]:
             try:
-                filename = f"{idx:04d}_{Path(key).name}"
-                local_path = download_path / filename
-                self.s3_client_raw.download_file(Bucket=self.raw_bucket, Key=key, Filename=str(local_path))
+                if self.check_shutdown(): raise InterruptedError()
+                if cache_path is not None:
+                    # Mirrors the key, so sorted paths keep listing order like the idx prefix does
+                    local_path = cache_path / key
+                    if (
+                        etag and cached_etags.get(key) == etag
+                        and local_path.is_file() and local_path.stat().st_size == size
+                    ):
+                        fetched_etags[key] = etag
+                        self._path_to_s3_key[str(local_path)] = key
+                        return local_path
+                    local_path.parent.mkdir(parents=True, exist_ok=True)
+                    part_path = local_path.with_name(local_path.name + '.part')
+                else:
+                    local_path = part_path = download_path / f"{idx:0{idx_width}d}_{Path(key).name}"
+                if size >= RANGED_GET_MIN_BYTES:
+                    # Large shard: parallel ranged GETs instead of one HTTP stream
+                    self.s3_client_raw.download_file(
+                        self.raw_bucket, key, str(part_path), Config=DOWNLOAD_TRANSFER_CONFIG
+                    )
+                else:
+                    # Plain GET instead of download_file: raw shards are small, s3transfer's
+                    # multipart/threadpool setup costs more than the transfer itself.
+                    resp = self.s3_client_raw.get_object(Bucket=self.raw_bucket, Key=key)
+                    with open(part_path, 'wb') as f:
+                        while chunk := resp['Body'].read(DOWNLOAD_CHUNK_SIZE):
+                            if self.check_shutdown(): raise InterruptedError()
+                            f.write(chunk)
+                if part_path != local_path:
+                    os.replace(part_path, local_path)
+                if etag:
+                    fetched_etags[key] = etag
                 self._path_to_s3_key[str(local_path)] = key
                 return local_path
+            except InterruptedError:
+                raise  # shutdown, not a missing shard
             except Exception:
                 return None
         
-        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS) as executor:
-            futures = {executor.submit(download_file, idx, f['key']): idx for idx, f in enumerate(files)}
-            for future in as_completed(futures):
-                result = future.result()
-                if result:
-                    local_files.append(result)
+        # At most DOWNLOAD_IN_FLIGHT shards queued per partition: the I/O pool is shared, so a
+        # huge partition must not park thousands of GETs ahead of other partitions' uploads.
+        pending_files = iter(enumerate(files))
+        futures: Dict[Future, int] = {}
+        def submit_next():
+            nxt = next(pending_files, None)
+            if nxt is not None:
+                idx, f = nxt
+                futures[self._io_pool.submit(download_file, idx, f['key'], f['size'], f.get('etag'))] = idx
+        for _ in range(DOWNLOAD_IN_FLIGHT):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            if self.check_shutdown():
+                # Drop queued shards instead of fetching the rest of the partition
+                for f in futures: f.cancel()
+                raise InterruptedError()
+            for future in done:
+                local_files[futures.pop(future)] = future.result()
+                submit_next()
         
-        return sorted(local_files)
+        if etags_path is not None:
+            # Rewritten from this listing only, so shards deleted upstream drop out of the map
+            tmp_path = etags_path.with_suffix('.tmp')
+            try:
+                tmp_path.write_text(json.dumps(fetched_etags, separators=(',', ':')))
+                os.replace(tmp_path, etags_path)
+            except OSError as e:
+                # Shards are already local; a stale sidecar only costs re-downloads next time
+                logger.warning(f"Could not write download cache ETags {etags_path}: {e}")
+        
+        return [p for p in local_files if p is not None]
     
-    def _merge_parquet_files(self, input_files: List[Path], output_path: Path, stream: str) -> dict:
+    def _merge_parquet_files(
+        self,
+        input_files: List[Path],
+        output_path: Path,
+        stream: str,
+        max_merge_buffer_bytes: int = MERGE_OUTPUT_BUFFER_BYTES,
+    ) -> dict:
         """
         Merge parquet files using streaming k-way merge.
         
-        Uses bounded memory: only one batch per file + output buffer.
+        Uses bounded memory: only one batch per file + output buffer
+        (at most max_merge_buffer_bytes of finished rows before they are written).
         Produces deterministic output sorted by (ts_event, file_idx, row_idx).
         Adds seq column for stable replay ordering.
         
@@ -736,164 +1183,191 @@ class CompactionJob:
         merger = StreamingMergeWriter(
             input_files=input_files,
             output_path=output_path,
+            output_buffer_bytes=max_merge_buffer_bytes,
             check_shutdown=self.check_shutdown,
             decode_dictionaries=trade_plain_mode,
             force_plain_output=trade_plain_mode,
-            force_disable_fastpath=trade_plain_mode
+            force_disable_fastpath=trade_plain_mode,
+            chunk_workers=self.merge_chunk_workers
         )
-        return merger.merge()
+        return self._cpu_pool.submit(merger.merge).result()
     
     def _upload_to_s3(self, local_path: Path, s3_key: str):
-        self.s3_client_compact.upload_file(Filename=str(local_path), Bucket=self.compact_bucket, Key=s3_key)
+        size = local_path.stat().st_size
+        if size <= SINGLE_PUT_MAX_BYTES:
+            # One PUT straight from the (usually tmpfs-staged) file; skips s3transfer's
+            # multipart/threadpool machinery, which only pays off for large objects.
+            with open(local_path, 'rb') as f:
+                self.s3_client_compact.put_object(Bucket=self.compact_bucket, Key=s3_key, Body=f)
+        else:
+            config = LARGE_UPLOAD_TRANSFER_CONFIG if size >= LARGE_UPLOAD_MIN_BYTES else UPLOAD_TRANSFER_CONFIG
+            self.s3_client_compact.upload_file(
+                Filename=str(local_path), Bucket=self.compact_bucket, Key=s3_key, Config=config
+            )
     
     def _verify_output_integrity(self, path: Path, expected_rows: int):
-        """Verify that output parquet is readable and has expected row count."""
+        """Verify that output parquet has a valid footer and the expected row count."""
         try:
-            pf = pq.ParquetFile(path)
-            actual_rows = 0
-            for batch in pf.iter_batches(batch_size=100_000):
-                actual_rows += batch.num_rows
+            with pa.memory_map(str(path)) as mm:
+                # Verify footer integrity
+                size = mm.size()
+                if size < 8:
+                    raise ValueError("Invalid parquet footer magic")
+                mm.seek(size - 4)
+                if mm.read(4) != b'PAR1':
+                    raise ValueError("Invalid parquet footer magic")
+                
+                # Row count from the footer: parsing the metadata already validates it,
+                # and re-decoding every page just to count rows cost a full re-read.
+                actual_rows = pq.ParquetFile(mm).metadata.num_rows
             
             if actual_rows != expected_rows:
                 raise ValueError(f"Row count mismatch: expected {expected_rows}, got {actual_rows}")
-            
-            # Verify footer integrity
-            with open(path, 'rb') as f:
-                f.seek(-4, 2)
-                if f.read(4) != b'PAR1':
-                    raise ValueError("Invalid parquet footer magic")
         except Exception as e:
             raise ValueError(f"Post-write verification failed: {e}") from e
     
+    def _upload_parallel(self, uploads: List[Tuple[Callable, tuple]]):
+        """Run independent uploads concurrently on the I/O pool; wait for all, then raise the first failure"""
+        if self.check_shutdown(): raise InterruptedError()
+        futures = [self._io_pool.submit(fn, *args) for fn, args in uploads]
+        errors = [f.exception() for f in futures]
+        for err in errors:
+            if err is not None:
+                raise err
+
     def _upload_json_to_s3(self, content: dict, s3_key: str):
         self.s3_client_compact.put_object(
             Bucket=self.compact_bucket,
             Key=s3_key,
-            Body=json.dumps(content, indent=2).encode('utf-8'),
+            Body=json.dumps(content, separators=(',', ':')).encode('utf-8'),
             ContentType='application/json'
         )
 
-    def _finalize_artifacts(self, base_keys: List[str]):
-        """Promote .tmp artifacts to final keys via copy+delete"""
-        for key in base_keys:
-            tmp_key = key + ".tmp"
-            logger.info(f"Promoting {tmp_key} -> {key}")
-            # Copy tmp to final
-            self.s3_client_compact.copy_object(
-                Bucket=self.compact_bucket,
-                CopySource={'Bucket': self.compact_bucket, 'Key': tmp_key},
-                Key=key
-            )
-            # Delete tmp
-            self.s3_client_compact.delete_object(
-                Bucket=self.compact_bucket,
-                Key=tmp_key
-            )
-
     def _fetch_quality_data(self, date_str: str) -> Dict:
         """Fetch all window JSONs for a date and aggregate quality"""
         quality_prefix = f"quality/date={date_str}/"
         paginator = self.s3_client_raw.get_paginator('list_objects_v2')
-        window_results = []
+        window_keys = []
         
-        for page in paginator.paginate(Bucket=self.raw_bucket, Prefix=quality_prefix):
+        for page in paginator.paginate(
+            Bucket=self.raw_bucket, Prefix=quality_prefix, PaginationConfig={'PageSize': LIST_PAGE_SIZE}
+        ):
             if 'Contents' not in page:
                 continue
-            for obj in page['Contents']:
-                if obj['Key'].endswith('.json'):
-                    try:
-                        resp = self.s3_client_raw.get_object(Bucket=self.raw_bucket, Key=obj['Key'])
-                        window_json = json.loads(resp['Body'].read().decode('utf-8'))
-                        assessment = QualityFilter.assess_window(window_json)
-                        window_results.append(assessment)
-                    except Exception as e:
-                        logger.error(f"Error reading quality window {obj['Key']}: {e}")
+            window_keys.extend(obj['Key'] for obj in page['Contents'] if obj['Key'].endswith('.json'))
+        
+        def fetch_window(key: str) -> Dict:
+            if self.check_shutdown(): raise InterruptedError()
+            resp = self.s3_client_raw.get_object(Bucket=self.raw_bucket, Key=key)
+            # json.loads takes the raw bytes directly; no intermediate str decode
+            return QualityFilter.assess_window(json.loads(resp['Body'].read()))
         
+        # One small GET per window: latency-bound, so fan out on the I/O pool
+        futures = [(key, self._io_pool.submit(fetch_window, key)) for key in window_keys]
+        window_results = []
+        for key, future in futures:
+            if self.check_shutdown():
+                # A partial window set could misgrade the day; let the caller stop instead
+                for _, f in futures: f.cancel()
+                raise InterruptedError("Shutdown requested")
+            try:
+                window_results.append(future.result())
+            except InterruptedError:
+                # Raised inside fetch_window: the window was skipped, not unreadable
+                for _, f in futures: f.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Error reading quality window {key}: {e}")
+
         return QualityFilter.aggregate_day(window_results)
 
     def discover_dates(self) -> Set[str]:
         """
         Fast O(1) discovery of processed dates in raw bucket using delimiters.
-        Walks: exchange=/ -> stream=/ -> symbol=/ -> date=/
+        Walks: exchange=/ -> stream=/ -> symbol=/ -> date=/ (each level fanned out)
         """
         logger.info("Discovering available dates in raw bucket...")
         dates = set()
-        
-        def list_prefixes(bucket: str, prefix: str) -> List[str]:
-            paginator = self.s3_client_raw.get_paginator('list_objects_v2')
-            prefixes = []
-            for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
-                for cp in page.get('CommonPrefixes', []):
-                    prefixes.append(cp['Prefix'])
-            return prefixes
-
-        # Level 1: Exchange
-        exchanges = list_prefixes(self.raw_bucket, "exchange=")
-        for ex_prefix in exchanges:
-            # Level 2: Stream
-            streams = list_prefixes(self.raw_bucket, ex_prefix + "stream=")
-            for st_prefix in streams:
-                # Level 3: Symbol
-                symbols = list_prefixes(self.raw_bucket, st_prefix + "symbol=")
-                for sy_prefix in symbols:
-                    # Level 4: Date
-                    date_prefixes = list_prefixes(self.raw_bucket, sy_prefix + "date=")
-                    for d_prefix in date_prefixes:
-                        # Extract date from "exchange=.../date=YYYYMMDD/"
-                        date_str = d_prefix.rstrip('/').split('=')[-1]
-                        if len(date_str) == 8 and date_str.isdigit():
-                            dates.add(date_str)
-        
+
+        with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+            # Level 4: Date (listed as soon as each symbol prefix is known)
+            date_futures = [
+                executor.submit(self._list_prefixes, sy + "date=")
+                for sy in self._iter_symbol_prefixes(executor)
+            ]
+            for future in as_completed(date_futures):
+                for d_prefix in future.result():
+                    # Extract date from "exchange=.../date=YYYYMMDD/"
+                    date_str = d_prefix.rstrip('/').split('=')[-1]
+                    if len(date_str) == 8 and date_str.isdigit():
+                        dates.add(date_str)
+
         return dates
 
     def discover_partitions_for_date(self, target_date: str) -> List[Dict]:
         """Find all partitions (ex/st/sy) for a specific date using delimiters"""
         partitions = []
-        
-        def list_prefixes(bucket: str, prefix: str) -> List[str]:
-            paginator = self.s3_client_raw.get_paginator('list_objects_v2')
-            prefixes = []
-            for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
-                for cp in page.get('CommonPrefixes', []):
-                    prefixes.append(cp['Prefix'])
-            return prefixes
-
-        exchanges = list_prefixes(self.raw_bucket, "exchange=")
-        for ex_prefix in exchanges:
-            streams = list_prefixes(self.raw_bucket, ex_prefix + "stream=")
-            for st_prefix in streams:
-                symbols = list_prefixes(self.raw_bucket, st_prefix + "symbol=")
-                for sy_prefix in symbols:
-                    target_prefix = f"{sy_prefix}date={target_date}/"
-                    # Check if this date exists for this symbol
-                    paginator = self.s3_client_raw.get_paginator('list_objects_v2')
-                    for page in paginator.paginate(Bucket=self.raw_bucket, Prefix=target_prefix, MaxKeys=1):
-                        if 'Contents' in page:
-                            # Partition found
-                            parts = sy_prefix.rstrip('/').split('/')
-                            partition = {
-                                'exchange': parts[0].split('=')[1],
-                                'stream': parts[1].split('=')[1],
-                                'symbol': parts[2].split('=')[1],
-                                'date': target_date
-                            }
-                            partitions.append(partition)
-                            break
-        
+
+        def has_date(sy_prefix: str) -> bool:
+            # Check if this date exists for this symbol
+            resp = self.s3_client_raw.list_objects_v2(
+                Bucket=self.raw_bucket, Prefix=f"{sy_prefix}date={target_date}/", MaxKeys=1
+            )
+            return 'Contents' in resp
+
+        with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+            probes = {sy: executor.submit(has_date, sy) for sy in self._iter_symbol_prefixes(executor)}
+            # Listing order (exchange/stream/symbol), independent of completion order
+            found = [sy for sy in sorted(probes) if probes[sy].result()]
+
+        for sy_prefix in found:
+            parts = sy_prefix.rstrip('/').split('/')
+            partitions.append({
+                'exchange': parts[0].split('=')[1],
+                'stream': parts[1].split('=')[1],
+                'symbol': parts[2].split('=')[1],
+                'date': target_date
+            })
+
         return partitions
 
+    def _list_prefixes(self, prefix: str) -> List[str]:
+        """List CommonPrefixes one level below prefix in the raw bucket"""
+        paginator = self.s3_client_raw.get_paginator('list_objects_v2')
+        prefixes = []
+        for page in paginator.paginate(
+            Bucket=self.raw_bucket, Prefix=prefix, Delimiter='/', PaginationConfig={'PageSize': LIST_PAGE_SIZE}
+        ):
+            for cp in page.get('CommonPrefixes', []):
+                prefixes.append(cp['Prefix'])
+        return prefixes
+
+    def _iter_symbol_prefixes(self, executor: ThreadPoolExecutor) -> Iterator[str]:
+        """
+        Walk exchange=/ -> stream=/ -> symbol=/ without per-level barriers: each LIST is submitted
+        as soon as its parent returns. Yields symbol prefixes in completion order.
+        """
+        stream_futures = [executor.submit(self._list_prefixes, ex + "stream=") for ex in self._list_prefixes("exchange=")]
+        symbol_futures = [
+            executor.submit(self._list_prefixes, st + "symbol=")
+            for future in as_completed(stream_futures)
+            for st in future.result()
+        ]
+        for future in as_completed(symbol_futures):
+            yield from future.result()
+
+def get_yesterday_date(now: Optional[datetime] = None) -> str:
+    return ((now or datetime.now()) - timedelta(days=1)).strftime('%Y%m%d')
+
 
-def get_yesterday_date() -> str:
-    return (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+def get_today_date(now: Optional[datetime] = None) -> str:
+    return (now or datetime.now()).strftime('%Y%m%d')
 
 
-def get_today_date() -> str:
-    return datetime.now().strftime('%Y%m%d')
+BYTE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
 
 
 def format_bytes(bytes_size: int) -> str:
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if bytes_size < 1024:
-            return f"{bytes_size:.1f} {unit}"
-        bytes_size /= 1024
-    return f"{bytes_size:.1f} TB"
+    # Unit straight from the bit length (10 bits per 1024x step) instead of a divide loop
+    i = min((int(bytes_size).bit_length() - 1) // 10, len(BYTE_UNITS) - 1) if bytes_size >= 1024 else 0
+    return f"{bytes_size / (1 << (10 * i)):.1f} {BYTE_UNITS[i]}"
@@ -3,23 +3,34 @@ QuantLab Streaming K-Way Merge Writer (Production Grade)
 
 Algorithm:
 1. Entry point: merge()
-2. If num_files > MAX_OPEN_FILES: perform hierarchical chunked merge.
+2. If num_files > MAX_OPEN_FILES: perform hierarchical chunked merge (chunks merged one by one,
+   or in parallel processes with chunk_workers > 1, then one final merge of the intermediate files).
 3. Check for Fast Path: if files are strictly non-overlapping, skip k-way and just concatenate batches.
-4. Otherwise: perform k-way merge using min-heap for deterministic ordering.
-5. Optimized loop: uses tuples and columnar buffering to minimize Python overhead.
+4. Small partitions (<= MERGE_IN_MEMORY_MAX_ROWS / _BYTES): stable in-memory sort by ts_event.
+5. Otherwise: perform k-way merge using min-heap for deterministic ordering. Overlapping
+   stretches are emitted in rounds: the rows every stream can contribute before the smallest
+   current-batch boundary are stable-sorted together in Arrow instead of popped one by one.
+6. Optimized loop: uses tuples and columnar buffering to minimize Python overhead.
 """
 
+import os
 import heapq
 import time
+import multiprocessing
+import pickle
+import queue
+import threading
 import logging
 import shutil
 import tempfile
 import hashlib
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import List, Dict, Optional, Tuple, Any, Callable
 
 import pyarrow as pa
+import pyarrow.compute
 import pyarrow.parquet as pq
 
 logger = logging.getLogger(__name__)
@@ -27,19 +38,67 @@ logger = logging.getLogger(__name__)
 # Configuration constants
 MERGE_BATCH_SIZE = 100_000          # Rows per input batch
 MERGE_OUTPUT_BUFFER_SIZE = 200_000  # Rows before flush to writer
+MERGE_OUTPUT_BUFFER_BYTES = 64 * 1024 * 1024  # ...or this many buffered output bytes, whichever comes first
 MERGE_LOG_INTERVAL = 5_000_000      # Log progress every N rows
 MAX_OPEN_FILES = 1200               # Max files to open simultaneously (safe for ulimit)
+MERGE_CHUNK_WORKERS = 1              # Processes merging hierarchical chunks concurrently (> 1 is opt-in)
+MERGE_PREFETCH_WORKERS = 4          # Threads reading each stream's next batch ahead of the merge
+MERGE_IN_MEMORY_MAX_ROWS = 2_000_000  # Partitions up to this many rows are sorted in memory
+MERGE_IN_MEMORY_MAX_BYTES = 512 * 1024 * 1024  # ...and up to this uncompressed size (footer estimate)
+OUTPUT_COMPRESSION_LEVEL = 3        # zstd level for merged output
+INTERMEDIATE_COMPRESSION = 'lz4'    # Hierarchical-merge scratch files: read back once, then deleted
+OUTPUT_DATA_PAGE_SIZE = 1024 * 1024  # Target data page size for merged output
+OUTPUT_WRITE_BATCH_SIZE = 65536      # Rows encoded per column chunk pass (default 1024)
+
+# Output ordering column, inserted right after ts_event
+SEQ_FIELD = pa.field('seq', pa.int64())
+
+
+def _seq_array(start: int, length: int) -> pa.Array:
+    """int64 array [start, start + length) built in Arrow C++ (no per-element Python ints)."""
+    ones = pa.repeat(pa.scalar(1, pa.int64()), length)
+    return pa.compute.cumulative_sum(ones, start=start - 1)
+
+
+def _ts_event_index(schema: pa.Schema, path: Path) -> int:
+    """Index of ts_event in schema. Every merge path orders by it, so its absence is an input error."""
+    idx = schema.get_field_index('ts_event')
+    if idx == -1:
+        raise ValueError(f"Missing ts_event column in {path}")
+    return idx
+
+
+def _footer_ts_index(md: pq.FileMetaData, path: Path) -> int:
+    """Column-chunk index of ts_event in a footer (no Arrow schema conversion)."""
+    try:
+        return md.schema.names.index('ts_event')
+    except ValueError:
+        raise ValueError(f"Missing ts_event column in {path}") from None
+
+
+def _footer_ts_range(md: pq.FileMetaData, ts_idx: int) -> Optional[Tuple[int, int]]:
+    """(min, max) ts_event over all non-empty row groups from footer statistics; None if any are missing."""
+    ts_min = ts_max = None
+    for i in range(md.num_row_groups):
+        rg = md.row_group(i)
+        if rg.num_rows == 0: continue
+        stats = rg.column(ts_idx).statistics
+        if stats is None or not stats.has_min_max: return None
+        if ts_min is None or stats.min < ts_min: ts_min = stats.min
+        if ts_max is None or stats.max > ts_max: ts_max = stats.max
+    return None if ts_min is None else (ts_min, ts_max)
 
 
 class FileStream:
     """
     Manages streaming reads from a single parquet file.
-    Holds only one batch in memory at a time.
+    Holds the current batch plus, with a prefetch pool, the next one being read in the background.
     """
     
     __slots__ = ['file_idx', 'path', 'pf', 'batch_iter', 'current_batch',
                  'batch_row_idx', 'global_row_idx', 'exhausted', 'schema', 'col_names',
-                 'decode_dicts', 'trade_fallback_enabled']
+                 'decode_dicts', 'trade_fallback_enabled', 'ts_idx', 'ts_values',
+                 'prefetch_pool', 'next_batch', 'buffered_rows']
     
     def __init__(
         self,
@@ -47,14 +106,21 @@ class FileStream:
         path: Path,
         batch_size: int,
         decode_dicts: bool = False,
-        trade_fallback_enabled: bool = False
+        trade_fallback_enabled: bool = False,
+        prefetch_pool: Optional[ThreadPoolExecutor] = None,
+        metadata: Optional[pq.FileMetaData] = None
     ):
         self.file_idx = file_idx
         self.path = path
         self.decode_dicts = decode_dicts
         self.trade_fallback_enabled = trade_fallback_enabled
+        self.prefetch_pool = prefetch_pool
+        self.next_batch: Optional[Future] = None
         try:
-            self.pf = pq.ParquetFile(path)
+            # Memory-mapped: column chunks are read straight from the page cache (or the
+            # tmpfs staging dir) instead of being copied through a buffered file reader.
+            # A footer the writer already parsed is reused rather than parsed and held twice.
+            self.pf = pq.ParquetFile(path, memory_map=True, metadata=metadata)
         except Exception as e:
             raise ValueError(f"Failed to open {path}: {e}") from e
             
@@ -62,33 +128,47 @@ class FileStream:
             self.schema = self._get_decoded_schema(self.pf.schema_arrow)
         else:
             self.schema = self.pf.schema_arrow
+        self.ts_idx = _ts_event_index(self.schema, path)
             
         self.col_names = self.schema.names
         if self.decode_dicts:
             self.batch_iter = self._iter_decoded_batches(batch_size)
         else:
-            self.batch_iter = self.pf.iter_batches(batch_size=batch_size)
+            self.batch_iter = self.pf.iter_batches(batch_size=batch_size, use_threads=True)
         self.current_batch: Optional[pa.RecordBatch] = None
+        self.ts_values: Optional[List[int]] = None  # current batch's ts_event as ints, built on first peek
         self.batch_row_idx = 0
         self.global_row_idx = 0
         self.exhausted = False
+        self.buffered_rows: Optional[List[int]] = None  # current-batch rows in the writer's output buffer
         
         # Load first batch
         self._load_next_batch()
     
     def _load_next_batch(self):
-        """Load next batch from iterator."""
+        """Load next batch from iterator (or take the one prefetched while the last was merged)."""
+        self.ts_values = None
+        future, self.next_batch = self.next_batch, None
+        self.current_batch = future.result() if future is not None else self._read_batch()
+        self.batch_row_idx = 0
+        if self.current_batch is None:
+            self.exhausted = True
+        elif self.prefetch_pool is not None:
+            # Decompress and decode the following batch while this one is merged; the iterator
+            # is only ever advanced by one thread at a time, since this future is awaited first
+            self.next_batch = self.prefetch_pool.submit(self._read_batch)
+
+    def _read_batch(self) -> Optional[pa.RecordBatch]:
+        """Next batch from the iterator, None once the file is exhausted."""
         try:
-            self.current_batch = next(self.batch_iter)
-            self.batch_row_idx = 0
+            batch = next(self.batch_iter)
         except StopIteration:
-            self.current_batch = None
-            self.exhausted = True
+            return None
         except Exception as e:
             raise ValueError(f"Failed to read batch from {self.path}: {e}") from e
-            
-        if self.current_batch and self.decode_dicts:
-            self.current_batch = self._decode_batch(self.current_batch)
+        if self.decode_dicts:
+            batch = self._decode_batch(batch)
+        return batch
 
     def _get_decoded_schema(self, schema: pa.Schema) -> pa.Schema:
         new_fields = []
@@ -102,7 +182,7 @@ class FileStream:
     def _iter_decoded_batches(self, batch_size: int):
         for row_group_idx in range(self.pf.num_row_groups):
             try:
-                table = self.pf.read_row_group(row_group_idx, use_threads=False)
+                table = self.pf.read_row_group(row_group_idx, use_threads=True)
             except Exception as e:
                 if self.trade_fallback_enabled and self._is_dict_conflict_error(e):
                     yield from self._iter_read_table_fallback(batch_size)
@@ -110,7 +190,8 @@ class FileStream:
                 raise
             arrays = []
             for i, field in enumerate(table.schema):
-                col = table.column(i).combine_chunks()
+                # dictionary_decode/cast take the ChunkedArray as is; no contiguous copy needed
+                col = table.column(i)
                 if pa.types.is_dictionary(field.type):
                     decoded = pa.compute.dictionary_decode(col)
                     target_type = field.type.value_type
@@ -131,12 +212,11 @@ class FileStream:
         logger.warning(
             f"[TradeFallback] DICT_CONFLICT detected -> using pq.read_table(read_dictionary=[]) path={self.path}"
         )
-        table = pq.read_table(self.path, use_threads=False, read_dictionary=[])
-        table = table.combine_chunks()
+        table = pq.read_table(self.path, use_threads=True, read_dictionary=[], memory_map=True)
         arrays = []
         fields = []
         for i, field in enumerate(table.schema):
-            col = table.column(i).combine_chunks()
+            col = table.column(i)
             if pa.types.is_dictionary(field.type):
                 decoded = pa.compute.dictionary_decode(col)
                 target_type = field.type.value_type
@@ -166,20 +246,28 @@ class FileStream:
                 new_arrays.append(col)
         return pa.RecordBatch.from_arrays(new_arrays, schema=self.schema)
     
+    def iter_remaining_batches(self):
+        """Yield the current batch and every batch after it (consumes the stream)."""
+        while not self.exhausted:
+            yield self.current_batch
+            self._load_next_batch()
+
     def has_rows(self) -> bool:
         """Check if stream has more rows available."""
         return not self.exhausted
     
-    def peek_sort_key(self) -> Tuple[int, int, int]:
+    def peek_sort_key(self, row_by_row: bool = False) -> Tuple[int, int, int]:
         """
         Get sort key for current row: (ts_event, file_idx, global_row_idx)
+        row_by_row: the caller is about to step through this batch one row at a time, so convert
+        its ts_event column once instead of boxing a scalar per row.
         """
-        ts_event = self.current_batch['ts_event'][self.batch_row_idx].as_py()
-        return (ts_event, self.file_idx, self.global_row_idx)
-    
-    def get_current_row_tuple(self) -> Tuple:
-        """Get current row as tuple of python objects (optimized)."""
-        return tuple(self.current_batch[i][self.batch_row_idx].as_py() for i in range(len(self.col_names)))
+        if self.ts_values is None:
+            if not row_by_row:
+                ts_event = self.current_batch.column(self.ts_idx)[self.batch_row_idx].as_py()
+                return (ts_event, self.file_idx, self.global_row_idx)
+            self.ts_values = self.current_batch.column(self.ts_idx).to_pylist()
+        return (self.ts_values[self.batch_row_idx], self.file_idx, self.global_row_idx)
     
     def advance(self):
         """Move to next row. Load new batch if needed."""
@@ -190,21 +278,128 @@ class FileStream:
             self._load_next_batch()
     
     def close(self):
-        """Close the parquet file."""
+        """Close the parquet file (after any in-flight prefetch has finished with it)."""
+        if self.next_batch is not None:
+            if not self.next_batch.cancel():
+                wait([self.next_batch])
+            self.next_batch = None
         try:
             self.pf.close()
         except:
             pass
 
 
-class HeapEntry:
-    """Wrapper for heap entries to enable proper comparison."""
-    __slots__ = ['key', 'stream']
-    def __init__(self, key: Tuple[int, int, int], stream: FileStream):
-        self.key = key
-        self.stream = stream
-    def __lt__(self, other: 'HeapEntry') -> bool:
-        return self.key < other.key
+def _chunk_worker_main(cpu_count: int, tasks, results):
+    """
+    Chunk merge process: merges (task id, input files, output path, kwargs) tasks until it gets
+    None. Spawned processes start with Arrow's full CPU pool, so it first takes its share of the
+    parent's (already split by run.py --workers) pool.
+    """
+    pa.set_cpu_count(cpu_count)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, input_files, output_path, kwargs = task
+        try:
+            StreamingMergeWriter(input_files, output_path, **kwargs).merge()
+            results.put((task_id, None))
+        except BaseException as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(str(e))
+            results.put((task_id, e))
+
+
+class _ChunkWorkers:
+    """
+    Spawned processes merging hierarchical chunks. Owned directly (not a pool library) so a
+    process that dies, e.g. OOM-killed, fails the merge instead of hanging it, and running
+    merges can be killed on shutdown.
+    """
+
+    def __init__(self, workers: int, cpu_count: int):
+        # spawn: merges also run on worker threads, and forking a multi-threaded process is unsafe
+        ctx = multiprocessing.get_context('spawn')
+        self.config = (workers, cpu_count)
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.processes = [
+            ctx.Process(target=_chunk_worker_main, args=(cpu_count, self.tasks, self.results), daemon=True)
+            for _ in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+    def run(self, chunks: List[Tuple[List[Path], Path, Dict[str, Any]]], check_shutdown: Callable[[], bool]):
+        """Merge all chunks; raises a failed chunk's error, or InterruptedError on shutdown."""
+        for task_id, (input_files, output_path, kwargs) in enumerate(chunks):
+            self.tasks.put((task_id, input_files, output_path, kwargs))
+        pending = set(range(len(chunks)))
+        while pending:
+            try:
+                task_id, error = self.results.get(timeout=1.0)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError("Chunk merge process died (exit codes "
+                                       f"{[process.exitcode for process in self.processes]})")
+            else:
+                if error is not None:
+                    raise error
+                pending.discard(task_id)
+            if pending and check_shutdown(): raise InterruptedError()
+
+    def terminate(self):
+        """Kill the processes, running merges included."""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        for q in (self.tasks, self.results):
+            q.cancel_join_thread()
+            q.close()
+
+
+_chunk_workers: Dict[Tuple[int, int], _ChunkWorkers] = {}
+_chunk_workers_lock = threading.Lock()
+
+
+def _get_chunk_workers(workers: int, cpu_count: int) -> _ChunkWorkers:
+    """
+    Chunk processes for the calling thread, kept across merges so a worker compacting many
+    large partitions spawns them (and imports pyarrow in them) once. Per thread, so killing
+    them never touches another thread's merge; keyed by pid so forked run.py workers never
+    reuse the parent's processes.
+    """
+    owner = (os.getpid(), threading.get_ident())
+    with _chunk_workers_lock:
+        pool = _chunk_workers.get(owner)
+    if pool is not None and pool.config != (workers, cpu_count):
+        _discard_chunk_workers()
+        pool = None
+    if pool is None:
+        pool = _ChunkWorkers(workers, cpu_count)
+        with _chunk_workers_lock:
+            _chunk_workers[owner] = pool
+    return pool
+
+
+def shutdown_chunk_workers():
+    """Kill every chunk process this process has kept (call once none of its merges is running)."""
+    pid = os.getpid()
+    with _chunk_workers_lock:
+        pools = [_chunk_workers.pop(owner) for owner in list(_chunk_workers) if owner[0] == pid]
+    for pool in pools:
+        pool.terminate()
+
+
+def _discard_chunk_workers():
+    """Kill the calling thread's chunk processes (after an error they may hold stale tasks)."""
+    with _chunk_workers_lock:
+        pool = _chunk_workers.pop((os.getpid(), threading.get_ident()), None)
+    if pool is not None:
+        pool.terminate()
 
 
 class StreamingMergeWriter:
@@ -218,33 +413,62 @@ class StreamingMergeWriter:
         output_path: Path,
         batch_size: int = MERGE_BATCH_SIZE,
         output_buffer_size: int = MERGE_OUTPUT_BUFFER_SIZE,
+        output_buffer_bytes: int = MERGE_OUTPUT_BUFFER_BYTES,
         log_interval: int = MERGE_LOG_INTERVAL,
         max_open_files: int = MAX_OPEN_FILES,
+        in_memory_max_rows: int = MERGE_IN_MEMORY_MAX_ROWS,
+        in_memory_max_bytes: int = MERGE_IN_MEMORY_MAX_BYTES,
         add_seq_column: bool = True,
         check_shutdown: Optional[Callable[[], bool]] = None,
         decode_dictionaries: bool = False,
         force_plain_output: bool = False,
-        force_disable_fastpath: bool = False
+        force_disable_fastpath: bool = False,
+        intermediate: bool = False,
+        chunk_workers: int = MERGE_CHUNK_WORKERS,
+        prefetch_workers: int = MERGE_PREFETCH_WORKERS
     ):
         self.input_files = sorted(input_files)
         self.output_path = output_path
         self.batch_size = batch_size
         self.output_buffer_size = output_buffer_size
+        self.output_buffer_bytes = output_buffer_bytes
         self.log_interval = log_interval
         self.max_open_files = max_open_files
+        self.in_memory_max_rows = in_memory_max_rows
+        self.in_memory_max_bytes = in_memory_max_bytes
         self.add_seq_column = add_seq_column
         self.check_shutdown = check_shutdown or (lambda: False)
         self.decode_dictionaries = decode_dictionaries
         self.force_plain_output = force_plain_output
         self.force_disable_fastpath = force_disable_fastpath
+        # Scratch output of a hierarchical chunk: favour encode/decode speed over size
+        self.intermediate = intermediate
+        self.chunk_workers = chunk_workers
+        self.prefetch_workers = prefetch_workers
         
         # State
         self.streams: List[FileStream] = []
-        self.heap: List[HeapEntry] = []
+        # (sort key, stream) tuples: heapq compares them in C, and keys are unique per stream
+        # (file_idx differs), so the stream itself is never compared
+        self.heap: List[Tuple[Tuple[int, int, int], FileStream]] = []
+        # Streams not yet in the heap, ordered by their footer lower bound (see _admit_streams)
+        self.pending: List[Tuple[Tuple[int, int, int], FileStream]] = []
         self.schema: Optional[pa.Schema] = None
+        self.footers: Optional[List[pq.FileMetaData]] = None  # per input file, see _input_metadata
+        self.prefetch_pool: Optional[ThreadPoolExecutor] = None  # shared by the streams, see _init_streams
         self.writer: Optional[pq.ParquetWriter] = None
-        self.output_buffer: List[Tuple] = []
+        # Single-row heap pops, kept as row indices (never as Python values). Each stream's rows
+        # are gathered with take() as soon as it moves past their batch, so no finished batch is
+        # held for the buffer; _flush_buffer restores output order over the gathered pieces.
+        self.output_buffer: List[int] = []  # file_idx of the stream each output row came from
+        self.output_buffer_pieces: Dict[int, List[pa.Table]] = {}  # file_idx -> gathered rows, in output order
+        # Finished output slices (with seq) waiting to be written as one row group
+        self.output_tables: List[pa.Table] = []
+        self.output_tables_rows = 0
+        self.output_tables_bytes = 0
         self.seq_idx = -1
+        # Cleared once an unsorted input is seen; the merge then continues row by row
+        self.batched_rounds = True
         
         # Stats
         self.rows_written = 0
@@ -259,7 +483,7 @@ class StreamingMergeWriter:
     
     def merge(self) -> Dict:
         """Entry point for merging."""
-        self.start_time = datetime.utcnow()
+        self.start_time = datetime.now(timezone.utc)
         num_files = len(self.input_files)
         
         if num_files > self.max_open_files:
@@ -290,6 +514,20 @@ class StreamingMergeWriter:
                         return self.merge()
                     raise
             else:
+                total_rows, total_bytes = self._input_footprint()
+                if 0 < total_rows <= self.in_memory_max_rows and total_bytes <= self.in_memory_max_bytes:
+                    logger.info(f"FASTPATH=FALLBACK: {reason}. SORTPATH=ON: {total_rows} rows sorted in memory.")
+                    try:
+                        result = self._sort_merge()
+                        if result is not None:
+                            return result
+                        logger.info("SORTPATH=FALLBACK: input file not sorted by ts_event. Switching to k-way merge.")
+                    except Exception as e:
+                        if "more than one dictionary" in str(e).lower() and not self.decode_dictionaries:
+                            logger.warning(f"SORTPATH=FALLBACK: dictionary_conflict in sort path. Retrying with decoding.")
+                            self.decode_dictionaries = True
+                            return self.merge()
+                        raise
                 logger.warning(f"FASTPATH=FALLBACK: {reason}. Switching to k-way merge.")
                 try:
                     return self._direct_merge()
@@ -304,38 +542,19 @@ class StreamingMergeWriter:
         """Perform chunked merge for large file counts."""
         num_files = len(self.input_files)
         temp_dir = tempfile.mkdtemp(prefix='merge_intermediate_')
-        intermediate_files = []
         
         try:
-            chunk_idx = 0
-            for i in range(0, num_files, self.max_open_files):
-                if self.check_shutdown(): raise InterruptedError()
-                chunk_files = self.input_files[i:i + self.max_open_files]
-                chunk_output = Path(temp_dir) / f"chunk_{chunk_idx:04d}.parquet"
-                
-                logger.info(f"Merging chunk {chunk_idx}: files {i} to {i + len(chunk_files) - 1}")
-                chunk_merger = StreamingMergeWriter(
-                    input_files=chunk_files,
-                    output_path=chunk_output,
-                    batch_size=self.batch_size,
-                    output_buffer_size=self.output_buffer_size,
-                    max_open_files=self.max_open_files,
-                    add_seq_column=False,
-                    check_shutdown=self.check_shutdown,
-                    decode_dictionaries=self.decode_dictionaries,
-                    force_plain_output=self.force_plain_output,
-                    force_disable_fastpath=self.force_disable_fastpath,
-                )
-                try:
-                    chunk_merger.merge()
-                except Exception as e:
-                    if "more than one dictionary" in str(e).lower() and not self.decode_dictionaries:
-                        logger.warning("HIERARCHICAL=FALLBACK: dictionary_conflict in chunk merge. Retrying with decoding.")
-                        self.decode_dictionaries = True
-                        return self._hierarchical_merge()
-                    raise
-                intermediate_files.append(chunk_output)
-                chunk_idx += 1
+            chunks = [self.input_files[i:i + self.max_open_files] for i in range(0, num_files, self.max_open_files)]
+            # Indexed by chunk, so the final merge sees the same inputs whatever order chunks finish in
+            intermediate_files = [Path(temp_dir) / f"chunk_{idx:04d}.parquet" for idx in range(len(chunks))]
+            try:
+                self._merge_chunks(chunks, intermediate_files)
+            except Exception as e:
+                if "more than one dictionary" in str(e).lower() and not self.decode_dictionaries:
+                    logger.warning("HIERARCHICAL=FALLBACK: dictionary_conflict in chunk merge. Retrying with decoding.")
+                    self.decode_dictionaries = True
+                    return self._hierarchical_merge()
+                raise
             
             logger.info(f"All chunks merged. Now merging {len(intermediate_files)} intermediate files.")
             final_merger = StreamingMergeWriter(
@@ -343,12 +562,15 @@ class StreamingMergeWriter:
                 output_path=self.output_path,
                 batch_size=self.batch_size,
                 output_buffer_size=self.output_buffer_size,
+                output_buffer_bytes=self.output_buffer_bytes,
                 max_open_files=self.max_open_files,
                 add_seq_column=self.add_seq_column,
                 check_shutdown=self.check_shutdown,
                 decode_dictionaries=self.decode_dictionaries,
                 force_plain_output=self.force_plain_output,
                 force_disable_fastpath=self.force_disable_fastpath,
+                chunk_workers=self.chunk_workers,
+                prefetch_workers=self.prefetch_workers,
             )
             try:
                 return final_merger.merge()
@@ -361,26 +583,73 @@ class StreamingMergeWriter:
         finally:
             shutil.rmtree(temp_dir, ignore_errors=True)
 
+    def _merge_chunks(self, chunks: List[List[Path]], outputs: List[Path]):
+        """
+        Merge each chunk of input files into its intermediate file. Chunks are independent, so
+        with chunk_workers > 1 they run in separate processes (the single-row and pass-through
+        steps of the k-way merge hold the GIL). Workers cannot call check_shutdown; it is polled
+        here instead, and the chunk processes are killed when it fires.
+        """
+        workers = min(self.chunk_workers, len(chunks))
+        kwargs = dict(
+            # Concurrent chunk merges split one merge's batch and prefetch budget, so peak
+            # memory and threads stay those of a single merge whatever chunk_workers is
+            batch_size=max(1, self.batch_size // max(1, workers)),
+            prefetch_workers=max(1, self.prefetch_workers // max(1, workers)),
+            output_buffer_size=self.output_buffer_size,
+            output_buffer_bytes=self.output_buffer_bytes,
+            max_open_files=self.max_open_files,
+            add_seq_column=False,
+            decode_dictionaries=self.decode_dictionaries,
+            force_plain_output=self.force_plain_output,
+            force_disable_fastpath=self.force_disable_fastpath,
+            intermediate=True,
+        )
+        if workers <= 1:
+            for idx, (chunk_files, chunk_output) in enumerate(zip(chunks, outputs)):
+                if self.check_shutdown(): raise InterruptedError()
+                logger.info(f"Merging chunk {idx}: {len(chunk_files)} files")
+                StreamingMergeWriter(chunk_files, chunk_output, check_shutdown=self.check_shutdown, **kwargs).merge()
+            return
+
+        logger.info(f"Merging {len(chunks)} chunks in {workers} processes")
+        pool = _get_chunk_workers(workers, max(1, pa.cpu_count() // workers))
+        try:
+            pool.run([(chunk_files, chunk_output, kwargs) for chunk_files, chunk_output in zip(chunks, outputs)],
+                     self.check_shutdown)
+        except BaseException:
+            # Running chunk merges can take minutes: kill them (and drop queued chunks) instead
+            # of waiting; their partial outputs are discarded with the scratch dir
+            _discard_chunk_workers()
+            raise
+
+    def _input_metadata(self) -> List[pq.FileMetaData]:
+        """
+        Footers of all input files, parsed once and shared by the ordering check, the sort-path
+        size gate and the fast concat. (Inputs are local and hot in the page cache; a thread pool
+        made these sub-millisecond parses slower, not faster.)
+        """
+        if self.footers is None:
+            self.footers = [pq.read_metadata(path) for path in self.input_files]
+        return self.footers
+
     def _check_ordering(self) -> Tuple[bool, str]:
         """Check if files are strictly non-overlapping and sorted by ts_event."""
         if len(self.input_files) <= 1: 
             return True, "single_file"
         try:
             prev_max = -1
-            for path in self.input_files:
-                pf = pq.ParquetFile(path)
-                ts_idx = -1
-                for i, name in enumerate(pf.schema_arrow.names):
-                    if name == 'ts_event': ts_idx = i; break
-                if ts_idx == -1: return False, "missing_ts_event"
+            for path, md in zip(self.input_files, self._input_metadata()):
+                if md.num_rows == 0:
+                    continue
+                ts_idx = _footer_ts_index(md, path)
                 
-                # Check row group statistics
-                stats = pf.metadata.row_group(0).column(ts_idx).statistics
-                if not stats or not stats.has_min_max: 
+                # File range from the statistics of every row group, not just the first
+                ts_range = _footer_ts_range(md, ts_idx)
+                if ts_range is None: 
                     return False, f"missing_stats:{path.name}"
                 
-                f_min = stats.min
-                f_max = stats.max
+                f_min, f_max = ts_range
                 
                 if f_min < prev_max:
                     return False, f"overlap:current_min({f_min}) < prev_max({prev_max}) at {path.name}"
@@ -393,49 +662,36 @@ class StreamingMergeWriter:
     def _fast_concat(self) -> Dict:
         """Fast path for non-overlapping files."""
         t0 = time.perf_counter()
-        first_pf = pq.ParquetFile(self.input_files[0])
-        base_schema = first_pf.schema_arrow
+        if self.footers:
+            base_schema = self.footers[0].schema.to_arrow_schema()
+        else:
+            base_schema = pq.read_schema(self.input_files[0])
         if self.force_plain_output:
             base_schema = self._plain_schema(base_schema)
-        ts_pos = -1
+        ts_pos = _ts_event_index(base_schema, self.input_files[0])
         
         if self.add_seq_column:
-            new_fields = []
-            for i, field in enumerate(base_schema):
-                new_fields.append(field)
-                if field.name == 'ts_event':
-                    new_fields.append(pa.field('seq', pa.int64()))
-                    ts_pos = i
-            self.schema = pa.schema(new_fields)
+            self.schema = base_schema.insert(ts_pos + 1, SEQ_FIELD)
         else:
             self.schema = base_schema
             
-        self.writer = pq.ParquetWriter(
-            self.output_path,
-            self.schema,
-            compression='zstd',
-            write_statistics=True,
-            use_dictionary=not self.force_plain_output
-        )
+        self.writer = self._open_writer()
         seq = 0
         
-        for path in self.input_files:
+        footers = self.footers or [None] * len(self.input_files)
+        for path, md in zip(self.input_files, footers):
             if self.check_shutdown(): raise InterruptedError()
-            pf = pq.ParquetFile(path)
-            ts_idx = [j for j, n in enumerate(pf.schema_arrow.names) if n == 'ts_event'][0]
-            stats = pf.metadata.row_group(0).column(ts_idx).statistics
-            if stats:
-                if self.ts_event_min is None or stats.min < self.ts_event_min: self.ts_event_min = stats.min
-                if self.ts_event_max is None or stats.max > self.ts_event_max: self.ts_event_max = stats.max
-                
-            for batch in pf.iter_batches(batch_size=self.batch_size):
+            pf = pq.ParquetFile(path, memory_map=True, metadata=md)
+            for batch in pf.iter_batches(batch_size=self.batch_size, use_threads=True):
+                # Exact range from the data (the footer stats of row group 0 miss later row groups)
+                ts_range = pa.compute.min_max(batch.column('ts_event')).as_py()
+                if self.ts_event_min is None or ts_range['min'] < self.ts_event_min: self.ts_event_min = ts_range['min']
+                if self.ts_event_max is None or ts_range['max'] > self.ts_event_max: self.ts_event_max = ts_range['max']
                 if self.force_plain_output:
                     batch = self._plain_batch(batch)
                 if self.add_seq_column:
-                    seq_arr = pa.array(range(seq, seq + batch.num_rows), type=pa.int64())
-                    arrays = [batch.column(j) for j in range(batch.num_columns)]
-                    arrays.insert(ts_pos + 1, seq_arr)
-                    batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+                    seq_arr = _seq_array(seq, batch.num_rows)
+                    batch = batch.add_column(ts_pos + 1, SEQ_FIELD, seq_arr)
                     seq += batch.num_rows
                 self.writer.write_batch(batch)
                 self.rows_written += batch.num_rows
@@ -444,6 +700,79 @@ class StreamingMergeWriter:
         self.t_loop = time.perf_counter() - t0
         return self._build_metadata()
 
+    def _input_footprint(self) -> Tuple[int, int]:
+        """
+        Total (rows, uncompressed bytes) from parquet footers, no data pages read.
+        Gates the in-memory sort so peak RSS stays bounded; larger inputs stream through k-way.
+        """
+        total_rows = 0
+        total_bytes = 0
+        for md in self._input_metadata():
+            total_rows += md.num_rows
+            total_bytes += sum(md.row_group(i).total_byte_size for i in range(md.num_row_groups))
+        return total_rows, total_bytes
+
+    def _sort_merge(self) -> Optional[Dict]:
+        """
+        In-memory path for small partitions.
+        Concatenates inputs in file order and stable-sorts by ts_event, which yields exactly the
+        k-way merge order (ts_event, file_idx, row_idx) without the per-row heap.
+        Returns None (nothing written) if an input is not itself sorted by ts_event, since the
+        k-way merge preserves intra-file order in that case and a global sort would not.
+        """
+        try:
+            t0 = time.perf_counter()
+            self._init_streams()
+            base_schema = self.streams[0].schema
+            if self.force_plain_output:
+                base_schema = self._plain_schema(base_schema)
+
+            tables = []
+            for s in self.streams:
+                if self.check_shutdown(): raise InterruptedError()
+                batches = list(s.iter_remaining_batches())
+                if not batches: continue
+                t = pa.Table.from_batches(batches, schema=s.schema)
+                if not self._is_ts_sorted(t['ts_event']):
+                    return None
+                if not t.schema.equals(base_schema):
+                    t = t.cast(base_schema)
+                tables.append(t)
+                s.close()
+            table = pa.concat_tables(tables)
+            self.t_init = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            sorted_table = table.sort_by([('ts_event', 'ascending')])
+            # sort_by materializes a reordered copy; drop the unsorted inputs before writing
+            del table, tables, t, batches
+            if self.add_seq_column:
+                ts_idx = sorted_table.schema.get_field_index('ts_event')
+                seq_array = _seq_array(0, sorted_table.num_rows)
+                sorted_table = sorted_table.add_column(ts_idx + 1, SEQ_FIELD, seq_array)
+            self.schema = sorted_table.schema
+            self.t_loop = time.perf_counter() - t0
+
+            tf0 = time.perf_counter()
+            ts_range = pa.compute.min_max(sorted_table['ts_event']).as_py()
+            self.ts_event_min, self.ts_event_max = ts_range['min'], ts_range['max']
+            self.writer = self._open_writer()
+            self.writer.write_table(sorted_table, row_group_size=self.output_buffer_size)
+            self.writer.close(); self.writer = None
+            self.rows_written = sorted_table.num_rows
+            del sorted_table
+            self.t_flush = time.perf_counter() - tf0
+            return self._build_metadata()
+        finally:
+            self._cleanup()
+
+    @staticmethod
+    def _is_ts_sorted(ts: pa.ChunkedArray) -> bool:
+        ts = ts.combine_chunks()
+        if len(ts) < 2:
+            return True
+        return pa.compute.all(pa.compute.greater_equal(ts.slice(1), ts.slice(0, len(ts) - 1))).as_py()
+
     def _direct_merge(self) -> Dict:
         """Standard k-way merge with columnar optimizations."""
         try:
@@ -455,16 +784,17 @@ class StreamingMergeWriter:
             self._init_schema_and_writer()
             
             if self.add_seq_column:
-                self.seq_idx = [i for i, n in enumerate(self.schema.names) if n == 'seq'][0]
+                self.seq_idx = self.schema.get_field_index('seq')
             
             t0 = time.perf_counter()
             self._merge_loop()
             self.t_loop = time.perf_counter() - t0
             
+            tf0 = time.perf_counter()
             if self.output_buffer:
-                tf0 = time.perf_counter()
                 self._flush_buffer()
-                self.t_flush += (time.perf_counter() - tf0)
+            self._write_output_tables()
+            self.t_flush += (time.perf_counter() - tf0)
             
             if self.writer: self.writer.close(); self.writer = None
             return self._build_metadata()
@@ -472,7 +802,10 @@ class StreamingMergeWriter:
             self._cleanup()
 
     def _init_streams(self):
-        for idx, path in enumerate(self.input_files):
+        # Owned per merge (not module level) so forked run.py workers never inherit its threads
+        self.prefetch_pool = ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix='merge-prefetch')
+        footers = self.footers or [None] * len(self.input_files)
+        for idx, (path, md) in enumerate(zip(self.input_files, footers)):
             self.streams.append(
                 FileStream(
                     idx,
@@ -480,31 +813,177 @@ class StreamingMergeWriter:
                     self.batch_size,
                     self.decode_dictionaries,
                     trade_fallback_enabled=self.force_disable_fastpath,
+                    prefetch_pool=self.prefetch_pool,
+                    metadata=md,
                 )
             )
 
     def _init_heap(self):
+        """
+        Seed the heap with the streams whose rows can come first; the rest wait in self.pending
+        until the merge reaches their footer ts_event lower bound. A stream alone in the heap
+        with nothing pending below it is then copied batch-wise instead of row by row.
+        """
         for s in self.streams:
-            if s.has_rows(): heapq.heappush(self.heap, HeapEntry(s.peek_sort_key(), s))
+            if not s.has_rows(): continue
+            ts_min = self._footer_ts_min(s)
+            if ts_min is None:
+                heapq.heappush(self.heap, (s.peek_sort_key(), s))
+            else:
+                self.pending.append(((ts_min, s.file_idx, 0), s))
+        self.pending.sort(key=lambda p: p[0])
+        self.pending.reverse()  # pop() from the end yields the lowest bound
+        self._admit_streams()
+
+    @staticmethod
+    def _footer_ts_min(s: FileStream) -> Optional[int]:
+        """Smallest ts_event over all row groups from footer statistics, None if any are missing."""
+        ts_range = _footer_ts_range(s.pf.metadata, _footer_ts_index(s.pf.metadata, s.path))
+        return None if ts_range is None else ts_range[0]
+
+    def _admit_streams(self):
+        """Move pending streams into the heap once their first row may precede the heap top."""
+        while self.pending and (not self.heap or self.pending[-1][0] <= self.heap[0][0]):
+            _, s = self.pending.pop()
+            heapq.heappush(self.heap, (s.peek_sort_key(), s))
+
+    def _passthrough_run(self, s: FileStream) -> int:
+        """
+        Rows of s's current batch (from the cursor) that precede every pending stream and the
+        other heads in the heap, i.e. that the k-way merge would emit consecutively from s anyway.
+        s must be the heap top.
+        """
+        ts = s.current_batch.column(s.ts_idx).slice(s.batch_row_idx)
+        # The root's children hold the smallest competing head key
+        bounds = [key for key, _ in self.heap[1:3]]
+        if self.pending:
+            bounds.append(self.pending[-1][0])
+        if not bounds:
+            return len(ts)
+        bound_ts, bound_idx, _ = min(bounds)
+        # Ties on ts_event go to the lower file index
+        cmp = pa.compute.less_equal if s.file_idx < bound_idx else pa.compute.less
+        stop = pa.compute.index(cmp(ts, pa.scalar(bound_ts, ts.type)), False).as_py()
+        return len(ts) if stop == -1 else stop
+
+    def _write_passthrough(self, s: FileStream, n_rows: int):
+        """Write n_rows of s's current batch straight to the output and advance s past them."""
+        if self.output_buffer:
+            self._flush_buffer()
+        batch = s.current_batch.slice(s.batch_row_idx, n_rows)
+        ts_range = pa.compute.min_max(batch.column(s.ts_idx)).as_py()
+        if self.ts_event_min is None or ts_range['min'] < self.ts_event_min: self.ts_event_min = ts_range['min']
+        if self.ts_event_max is None or ts_range['max'] > self.ts_event_max: self.ts_event_max = ts_range['max']
+        if self.force_plain_output:
+            batch = self._plain_batch(batch)
+        if self.add_seq_column:
+            batch = batch.add_column(self.seq_idx, SEQ_FIELD, _seq_array(self.rows_written, n_rows))
+        table = pa.Table.from_batches([batch])
+        if not table.schema.equals(self.schema):
+            table = table.cast(self.schema)
+        self._emit(table)
+        self.rows_written += n_rows
+        s.batch_row_idx += n_rows
+        s.global_row_idx += n_rows
+        if s.batch_row_idx >= len(s.current_batch):
+            s._load_next_batch()
+
+    def _merge_round(self) -> int:
+        """
+        Batched merge step for overlapping streams. Every row whose key is at most the smallest
+        "last key in the current batch" over the heap (and below the lowest pending bound) is
+        emitted by the heap before anything else, so those per-stream prefixes are gathered,
+        stable-sorted by ts_event in Arrow and written in one go. Returns the rows written;
+        0 means an input is not sorted, and the rest of the merge pops the heap row by row.
+        """
+        bounds = []
+        for _, s in self.heap:
+            ts_col = s.current_batch.column(s.ts_idx)
+            last = len(s.current_batch) - 1
+            bounds.append((ts_col[last].as_py(), s.file_idx, s.global_row_idx + last - s.batch_row_idx))
+        cut_ts, cut_idx, _ = min(bounds)
+        pend_ts, pend_idx, _ = self.pending[-1][0] if self.pending else (None, None, 0)
+
+        # Gathered in file order, so the stable sort breaks ts_event ties by file_idx, then row
+        slices = []
+        for s in sorted((s for _, s in self.heap), key=lambda s: s.file_idx):
+            ts = s.current_batch.column(s.ts_idx).slice(s.batch_row_idx)
+            cmp = pa.compute.less_equal if s.file_idx <= cut_idx else pa.compute.less
+            keep = cmp(ts, pa.scalar(cut_ts, ts.type))
+            if pend_ts is not None:
+                cmp = pa.compute.less_equal if s.file_idx < pend_idx else pa.compute.less
+                keep = pa.compute.and_(keep, cmp(ts, pa.scalar(pend_ts, ts.type)))
+            stop = pa.compute.index(keep, False).as_py()
+            n = len(ts) if stop == -1 else stop
+            if n == 0: continue
+            if not self._is_ts_sorted(pa.chunked_array([ts.slice(0, n)])):
+                # The heap keeps intra-file order for unsorted inputs; a sort would not
+                self.batched_rounds = False
+                return 0
+            slices.append((s, n))
+        if not slices:
+            self.batched_rounds = False
+            return 0
+
+        if self.output_buffer:
+            self._flush_buffer()
+        base_schema = self.schema.remove(self.seq_idx) if self.add_seq_column else self.schema
+        tables = []
+        for s, n in slices:
+            t = pa.Table.from_batches([s.current_batch.slice(s.batch_row_idx, n)])
+            if not t.schema.equals(base_schema):
+                t = t.cast(base_schema)
+            tables.append(t)
+        table = pa.concat_tables(tables).sort_by([('ts_event', 'ascending')])
+        n_rows = table.num_rows
+        ts_range = pa.compute.min_max(table['ts_event']).as_py()
+        if self.ts_event_min is None or ts_range['min'] < self.ts_event_min: self.ts_event_min = ts_range['min']
+        if self.ts_event_max is None or ts_range['max'] > self.ts_event_max: self.ts_event_max = ts_range['max']
+        if self.add_seq_column:
+            table = table.add_column(self.seq_idx, SEQ_FIELD, _seq_array(self.rows_written, n_rows))
+        self._emit(table)
+        self.rows_written += n_rows
+
+        for s, n in slices:
+            s.batch_row_idx += n
+            s.global_row_idx += n
+            if s.batch_row_idx >= len(s.current_batch):
+                s._load_next_batch()
+        self.heap = [(s.peek_sort_key(), s) for _, s in self.heap if s.has_rows()]
+        heapq.heapify(self.heap)
+        self._admit_streams()
+        return n_rows
 
     def _init_schema_and_writer(self):
         base_schema = self.streams[0].schema
         if self.force_plain_output:
             base_schema = self._plain_schema(base_schema)
         if self.add_seq_column:
-            fields = []
-            for f in base_schema:
-                fields.append(f)
-                if f.name == 'ts_event': fields.append(pa.field('seq', pa.int64()))
-            self.schema = pa.schema(fields)
+            self.schema = base_schema.insert(_ts_event_index(base_schema, self.streams[0].path) + 1, SEQ_FIELD)
         else:
             self.schema = base_schema
-        self.writer = pq.ParquetWriter(
+        self.writer = self._open_writer()
+
+    def _open_writer(self) -> pq.ParquetWriter:
+        """Output writer for self.schema (shared by all merge paths)."""
+        if self.intermediate:
+            # Only the final merge reads it: ts_event stats feed its ordering check and stream
+            # admission, no other column is ever filtered on, and dictionary pages would just be
+            # built here to be decoded there (the Arrow schema still restores dictionary types)
+            compression, compression_level = INTERMEDIATE_COMPRESSION, None
+            write_statistics, use_dictionary = ['ts_event'], False
+        else:
+            compression, compression_level = 'zstd', OUTPUT_COMPRESSION_LEVEL
+            write_statistics, use_dictionary = True, not self.force_plain_output
+        return pq.ParquetWriter(
             self.output_path,
             self.schema,
-            compression='zstd',
-            write_statistics=True,
-            use_dictionary=not self.force_plain_output
+            compression=compression,
+            compression_level=compression_level,
+            data_page_size=OUTPUT_DATA_PAGE_SIZE,
+            write_batch_size=OUTPUT_WRITE_BATCH_SIZE,
+            write_statistics=write_statistics,
+            use_dictionary=use_dictionary
         )
 
     def _plain_schema(self, schema: pa.Schema) -> pa.Schema:
@@ -520,11 +999,10 @@ class StreamingMergeWriter:
         return pa.schema(fields)
 
     def _plain_batch(self, batch: pa.RecordBatch) -> pa.RecordBatch:
-        table = pa.Table.from_batches([batch]).combine_chunks()
         arrays = []
         fields = []
-        for i, field in enumerate(table.schema):
-            col = table.column(i).combine_chunks()
+        for i, field in enumerate(batch.schema):
+            col = batch.column(i)
             if pa.types.is_dictionary(field.type):
                 arr = pa.compute.dictionary_decode(col)
                 target_type = field.type.value_type
@@ -542,15 +1020,37 @@ class StreamingMergeWriter:
     def _merge_loop(self):
         last_log = 0
         while self.heap:
-            entry = heapq.heappop(self.heap)
-            s = entry.stream
-            ts = entry.key[0]
-            if self.ts_event_min is None or ts < self.ts_event_min: self.ts_event_min = ts
-            if self.ts_event_max is None or ts > self.ts_event_max: self.ts_event_max = ts
-            
-            self.output_buffer.append(s.get_current_row_tuple())
+            # Cascade: drain a lone stream, copy a batch that no other stream interleaves with,
+            # merge an overlapping stretch in one sorted round, and only then pop single rows
+            if len(self.heap) == 1 or self.batched_rounds:
+                s = self.heap[0][1]
+                run = self._passthrough_run(s)
+                if run > 0 and (len(self.heap) == 1 or run == len(s.current_batch) - s.batch_row_idx):
+                    tf0 = time.perf_counter()
+                    self._write_passthrough(s, run)
+                    self.t_flush += (time.perf_counter() - tf0)
+                    heapq.heappop(self.heap)
+                    if s.has_rows(): heapq.heappush(self.heap, (s.peek_sort_key(), s))
+                    self._admit_streams()
+                    continue
+                if len(self.heap) > 1 and self._merge_round():
+                    continue
+
+            s = self.heap[0][1]
+            batch = s.current_batch
+            rows = s.buffered_rows
+            if rows is None:
+                rows = s.buffered_rows = []
+            rows.append(s.batch_row_idx)
+            self.output_buffer.append(s.file_idx)
             s.advance()
-            if s.has_rows(): heapq.heappush(self.heap, HeapEntry(s.peek_sort_key(), s))
+            if s.batch_row_idx == 0:
+                # s moved past this batch: keep only its buffered rows
+                self._gather_buffered_rows(s, batch)
+            # One sift instead of a pop followed by a push
+            if s.has_rows(): heapq.heapreplace(self.heap, (s.peek_sort_key(row_by_row=True), s))
+            else: heapq.heappop(self.heap)
+            self._admit_streams()
             
             if len(self.output_buffer) >= self.output_buffer_size:
                 tf0 = time.perf_counter()
@@ -561,41 +1061,80 @@ class StreamingMergeWriter:
                 logger.info(f"Progress: {self.rows_written:,} rows written")
                 last_log = self.rows_written
 
+    def _gather_buffered_rows(self, s: FileStream, batch: pa.RecordBatch):
+        """Take s's buffered rows out of batch into a small piece, so the batch can be released."""
+        piece = pa.Table.from_batches([batch.take(pa.array(s.buffered_rows, pa.int64()))])
+        s.buffered_rows = None
+        base_schema = self.schema.remove(self.seq_idx) if self.add_seq_column else self.schema
+        if not piece.schema.equals(base_schema):
+            piece = piece.cast(base_schema)
+        self.output_buffer_pieces.setdefault(s.file_idx, []).append(piece)
+
     def _flush_buffer(self):
         if not self.output_buffer: return
         n_rows = len(self.output_buffer)
-        n_cols = len(self.schema)
-        cols = [[] for _ in range(n_cols)]
-        
+        for s in self.streams:
+            if s.buffered_rows:
+                self._gather_buffered_rows(s, s.current_batch)
+        # Only the gathered rows are concatenated (grouped by stream, each in output order)
+        pieces = [p for file_idx in sorted(self.output_buffer_pieces) for p in self.output_buffer_pieces[file_idx]]
+        table = pieces[0] if len(pieces) == 1 else pa.concat_tables(pieces)
+        if len(self.output_buffer_pieces) > 1:
+            # Row j of the grouped table is output row order[j] (stable sort by file_idx), so
+            # the inverse permutation restores output order
+            order = pa.compute.sort_indices(pa.array(self.output_buffer, pa.int32()))
+            table = table.take(pa.compute.sort_indices(order))
+        ts_range = pa.compute.min_max(table['ts_event']).as_py()
+        if self.ts_event_min is None or ts_range['min'] < self.ts_event_min: self.ts_event_min = ts_range['min']
+        if self.ts_event_max is None or ts_range['max'] > self.ts_event_max: self.ts_event_max = ts_range['max']
         if self.add_seq_column:
-            seq_start = self.rows_written
-            for r, row in enumerate(self.output_buffer):
-                ci = 0
-                for oi in range(n_cols):
-                    if oi == self.seq_idx: cols[oi].append(seq_start + r)
-                    else: cols[oi].append(row[ci]); ci += 1
-        else:
-            for row in self.output_buffer:
-                for i in range(n_cols): cols[i].append(row[i])
-        
-        batch = pa.RecordBatch.from_arrays([pa.array(cols[i], type=self.schema.field(i).type) for i in range(n_cols)], schema=self.schema)
-        self.writer.write_batch(batch)
+            table = table.add_column(self.seq_idx, SEQ_FIELD, _seq_array(self.rows_written, n_rows))
+        self._emit(table)
         self.rows_written += n_rows
+        self._clear_output_buffer()
+
+    def _clear_output_buffer(self):
         self.output_buffer.clear()
+        self.output_buffer_pieces.clear()
+        for s in self.streams:
+            s.buffered_rows = None
+
+    def _emit(self, table: pa.Table):
+        """
+        Queue finished output rows. Pass-through copies and merge rounds can be small, and every
+        write_table call closes a row group, so slices are collected until output_buffer_size
+        rows or output_buffer_bytes are buffered and then written together.
+        """
+        self.output_tables.append(table)
+        self.output_tables_rows += table.num_rows
+        self.output_tables_bytes += table.nbytes
+        if (self.output_tables_rows >= self.output_buffer_size
+                or self.output_tables_bytes >= self.output_buffer_bytes):
+            self._write_output_tables()
+
+    def _write_output_tables(self):
+        if not self.output_tables: return
+        tables = self.output_tables
+        table = tables[0] if len(tables) == 1 else pa.concat_tables(tables)
+        self.writer.write_table(table, row_group_size=max(table.num_rows, 1))
+        self.output_tables = []
+        self.output_tables_rows = 0
+        self.output_tables_bytes = 0
 
     def _build_metadata(self) -> Dict:
         dur = None
-        if self.start_time: dur = int((datetime.utcnow() - self.start_time).total_seconds() * 1000)
+        if self.start_time: dur = int((datetime.now(timezone.utc) - self.start_time).total_seconds() * 1000)
         
-        # Calculate SHA256 of the output file
+        # Calculate SHA256 of the output file (memory-mapped: one pass, no per-chunk copies).
+        # Hierarchical scratch chunks are skipped: only the final merge reads them, then they are deleted.
         sha256 = "N/A"
+        output_bytes = 0
         try:
-            if self.output_path.exists():
-                h = hashlib.sha256()
-                with open(self.output_path, "rb") as f:
-                    for chunk in iter(lambda: f.read(4096), b""):
-                        h.update(chunk)
-                sha256 = h.hexdigest()
+            if self.output_path.exists() and not self.intermediate:
+                with pa.memory_map(str(self.output_path)) as mm:
+                    buf = mm.read_buffer()
+                    output_bytes = buf.size
+                    sha256 = hashlib.sha256(memoryview(buf)).hexdigest()
         except: pass
 
         return {
@@ -603,8 +1142,9 @@ class StreamingMergeWriter:
             'ts_event_min': self.ts_event_min, 
             'ts_event_max': self.ts_event_max,
             'sha256': sha256,
+            'output_bytes': output_bytes,
             'input_parts': len(self.input_files), 
-            'created_at': datetime.utcnow().isoformat() + 'Z',
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
             'compaction_version': 'kway-merge-v1-opt', 
             'duration_ms': dur,
             'timings': {'init': self.t_init, 'loop': self.t_loop, 'flush': self.t_flush}
@@ -615,4 +1155,8 @@ class StreamingMergeWriter:
             try: self.writer.close()
             except: pass
         for s in self.streams: s.close()
-        self.streams.clear(); self.heap.clear(); self.output_buffer.clear()
+        if self.prefetch_pool:
+            self.prefetch_pool.shutdown(wait=True)
+            self.prefetch_pool = None
+        self.streams.clear(); self.heap.clear(); self.pending.clear(); self._clear_output_buffer()
+        self.output_tables = []
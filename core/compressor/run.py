@@ -12,14 +12,13 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from dotenv import load_dotenv
-from compact import CompactionJob, get_today_date, format_bytes, logger, Colors
+from compact import CompactionJob, get_today_date, get_yesterday_date, format_bytes, logger, Colors
 from backfill_planner import BackfillPlanner
 
 import argparse
 from datetime import datetime, timedelta
 import signal
 import time
-import json
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List, Dict, Set, Optional, Any
 import multiprocessing
@@ -85,18 +84,33 @@ class StatusReporter:
                         f"ETA: {eta_desc}   ")
         sys.stdout.flush()
 
+# Per-worker-process job, reused across partitions so batched state updates span them
+_worker_job = None
+_worker_job_cfg = None
+
 def process_partition_wrapper(p_args):
     """Pickleable wrapper for ProcessPoolExecutor"""
+    global _worker_job, _worker_job_cfg
     job_cfg, kwargs, s_event = p_args
     from compact import CompactionJob
     
-    # Re-initialize job in worker process
-    job = CompactionJob(**job_cfg)
+    # Initialize job once per worker process (state flushes on worker exit)
+    if _worker_job is None or _worker_job_cfg != job_cfg:
+        if _worker_job is not None:
+            _worker_job.close()
+        _worker_job = CompactionJob(**job_cfg, batch_state_updates=True)
+        _worker_job_cfg = job_cfg
+    job = _worker_job
     # Set the cross-process shutdown check
     job.check_shutdown = lambda: s_event.is_set()
     
     return job.compact_date_partition(**kwargs)
 
+def init_worker_threads(workers: int):
+    """Split Arrow's decode/encode thread pool across ProcessPool workers instead of oversubscribing"""
+    import pyarrow as pa
+    pa.set_cpu_count(max(1, (os.cpu_count() or 1) // max(1, workers)))
+
 def main():
     global shutdown_requested
     parser = argparse.ArgumentParser(description='QuantLab Parquet Compaction Runner')
@@ -121,6 +135,11 @@ def main():
     parser.add_argument('--max-symbols', type=int, help='Limit unique symbols processed')
     parser.add_argument('--max-days', type=int, help='Max number of days to process (defaults to 10000 for backfill, 1 for daily)')
     parser.add_argument('--workers', type=int, default=1, help='Number of parallel workers (ProcessPool)')
+    parser.add_argument('--state-lock', choices=['s3', 'fcntl'], default='s3',
+                        help='State update lock: s3 (multi-host safe) or fcntl (all runners on this host, no S3 round-trips)')
+    parser.add_argument('--merge-chunk-workers', type=int, default=1,
+                        help='Processes per hierarchical merge (partitions over MAX_OPEN_FILES shards); CPU and memory budgets are split across them')
+    parser.add_argument('--download-cache', help='Keep raw shards in this dir until the partition commits; retries skip re-downloading unchanged ones')
     
     # Quicktest args
     parser.add_argument('--date', help='Target date for quicktest (YYYYMMDD)')
@@ -186,7 +205,11 @@ def main():
         'compact_secret_key': compact_secret_key,
         'raw_bucket': raw_bucket,
         'compact_bucket': compact_bucket,
-        'state_key': state_key
+        'state_key': state_key,
+        'state_lock_backend': args.state_lock,
+        'download_cache_dir': args.download_cache,
+        'staging_workers': args.workers or 1,
+        'merge_chunk_workers': args.merge_chunk_workers
     }
     
     job = CompactionJob(**job_cfg)
@@ -226,10 +249,15 @@ def main():
     
     job.state_manager.cleanup_stale_locks()
     
+    # Single clock read per run: today/yesterday stay consistent across midnight
+    run_now = datetime.now()
+    today = get_today_date(run_now)
+    yesterday = get_yesterday_date(run_now)
+    
     if args.quality_report:
         logger.info("\n" + "=" * 30 + " QUALITY REPORT (Last 14 Days) " + "=" * 30)
         for i in range(14, 0, -1):
-            target = (datetime.now() - timedelta(days=i)).strftime('%Y%m%d')
+            target = (run_now - timedelta(days=i)).strftime('%Y%m%d')
             try:
                 report = job._fetch_quality_data(target)
                 s = report['stats']
@@ -254,7 +282,6 @@ def main():
 
     # 1. Determine dates
     last_date = job.state_manager.get_last_compacted_date()
-    today = get_today_date()
     
     if args.mode == 'cleanup':
         if not args.date_from:
@@ -280,14 +307,17 @@ def main():
                 prefix = f"exchange={p['exchange']}/stream={p['stream']}/symbol={p['symbol']}/date={date}/"
                 logger.info(f"Cleaning partition: {prefix} (Apply: {args.apply})")
                 if args.apply:
-                    resp = job.s3_client_compact.list_objects_v2(Bucket=compact_bucket, Prefix=prefix)
-                    for obj in resp.get('Contents', []):
-                        job.s3_client_compact.delete_object(Bucket=compact_bucket, Key=obj['Key'])
-                    state = job.state_manager._read_state()
+                    # One batched delete per listing page (<= 1000 keys) instead of a round trip per key
+                    paginator = job.s3_client_compact.get_paginator('list_objects_v2')
+                    for page in paginator.paginate(Bucket=compact_bucket, Prefix=prefix):
+                        objs = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+                        if objs:
+                            job.s3_client_compact.delete_objects(
+                                Bucket=compact_bucket, Delete={'Objects': objs, 'Quiet': True}
+                            )
+                    # Same locked read-modify-write as every other state update
                     key = f"{p['exchange']}/{p['stream']}/{p['symbol']}/{date}"
-                    if key in state.get("partitions", {}):
-                        del state["partitions"][key]
-                        job.s3_client_compact.put_object(Bucket=compact_bucket, Key="compacted/_state.json", Body=json.dumps(state, indent=2).encode('utf-8'))
+                    job.state_manager._update_state(lambda s, key=key: s.get("partitions", {}).pop(key, None))
                 else: logger.info("DRY-RUN: Use --apply to execute.")
         sys.exit(0)
 
@@ -308,7 +338,7 @@ def main():
             if dates:
                 target_date = dates[0]
             else:
-                target_date = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+                target_date = yesterday
         
         logger.info(f"QUICKTEST | selected_date={target_date} | today_excluded=YES | workers={args.workers or 2}")
         missing_dates = [target_date]
@@ -333,7 +363,6 @@ def main():
             logger.info(f"REVERSE BACKFILL: Targeting {missing_dates}")
             
     elif args.mode == 'daily':
-        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
         # Idempotent check for yesterday
         planner = BackfillPlanner(job.discover_dates(), job.state_manager, today)
         missing_dates = [d for d in planner.plan_reverse() if d == yesterday]
@@ -343,7 +372,6 @@ def main():
     else: # catch-up
         raw_dates = sorted(list(job.discover_dates()))
         if last_date is None:
-            yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
             if yesterday in raw_dates: missing_dates = [yesterday]
         else:
             missing_dates = [d for d in raw_dates if last_date < d < today]
@@ -365,7 +393,10 @@ def main():
         job.state_manager.cleanup_stale_locks(target_date)
         
         # Day-level Quality Check
-        quality_report = job._fetch_quality_data(target_date)
+        try:
+            quality_report = job._fetch_quality_data(target_date)
+        except InterruptedError:
+            break
         if quality_report['day_quality'] == 'BAD' and args.mode != 'quicktest':
             logger.warning(Colors.colorate(f"DAY QUARANTINE: {target_date} (Quality is BAD)", Colors.YELLOW))
             job.state_manager.log_day_status(target_date, 'quarantine')
@@ -419,7 +450,7 @@ def main():
         t0_day = time.time()
         
         # PARALLEL EXECUTION
-        executor = ProcessPoolExecutor(max_workers=args.workers)
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker_threads, initargs=(args.workers,))
         try:
             futures = {}
             for p in filtered:
@@ -250,9 +250,151 @@ def run_dictionary_hierarchical_test():
         schema = pf.schema_arrow
         assert "symbol" in schema.names, "symbol column missing!"
 
+        # Chunks merged in worker processes must match the in-process chunk merge
+        hashes = []
+        for workers in (1, 2):
+            chunk_out = tmpdir / f"out_workers{workers}.parquet"
+            StreamingMergeWriter(
+                input_files,
+                chunk_out,
+                max_open_files=2,
+                output_buffer_size=2,
+                batch_size=2,
+                chunk_workers=workers,
+            ).merge()
+            hashes.append(compute_row_hash(chunk_out))
+        assert hashes[0] == hashes[1], "Parallel chunk merge differs from serial!"
+
+        # Shutdown during parallel chunk merges: the running chunk processes are killed rather
+        # than waited for. Unsorted inputs keep each chunk in the slow single-row path.
+        import random
+        import time
+        import multiprocessing
+        rnd = random.Random(3)
+        slow_files = []
+        for i in range(4):
+            path = tmpdir / f"slow{i}.parquet"
+            pq.write_table(pa.table({'ts_event': pa.array([rnd.randint(0, 10**9) for _ in range(400_000)], type=pa.int64())}), path)
+            slow_files.append(path)
+        t0 = time.perf_counter()
+        try:
+            StreamingMergeWriter(
+                slow_files,
+                tmpdir / "out_shutdown.parquet",
+                max_open_files=2,
+                in_memory_max_rows=0,
+                force_disable_fastpath=True,
+                chunk_workers=2,
+                check_shutdown=lambda: True,
+            ).merge()
+            raise AssertionError("Shutdown did not interrupt the chunk merges!")
+        except InterruptedError:
+            pass
+        elapsed = time.perf_counter() - t0
+        assert not multiprocessing.active_children(), "Chunk processes still alive after shutdown!"
+        assert not (tmpdir / "out_shutdown.parquet").exists(), "Output written despite shutdown!"
+        print(f"      Shutdown stopped parallel chunk merges after {elapsed:.1f}s")
+
         print("\n✅ DICTIONARY + HIERARCHICAL TEST PASSED\n")
 
 
+def run_kway_merge_test():
+    """
+    Exercise the streaming k-way merge itself (merge rounds, pass-through copies and the
+    single-row take() path), which the small inputs above never reach: every partition
+    below MERGE_IN_MEMORY_MAX_ROWS is handled by the fast concat or the in-memory sort.
+    """
+    print("\n" + "="*60)
+    print("K-WAY MERGE TEST")
+    print("="*60)
+
+    import heapq
+    import random
+    import pyarrow as pa
+
+    rnd = random.Random(7)
+    dict_ty = pa.dictionary(pa.int32(), pa.string())
+
+    def create_kway_parquet(path: Path, file_no: int, ts_events: list):
+        # Small row groups + small batches below: every file spans several batches
+        table = pa.table({
+            'ts_event': pa.array(ts_events, type=pa.int64()),
+            'symbol': pa.array([rnd.choice(['A', 'B', f'S{file_no}']) for _ in ts_events], type=dict_ty),
+            'row': pa.array([f'{file_no}:{i}' for i in range(len(ts_events))], type=pa.string()),
+        })
+        pq.write_table(table, path, row_group_size=16)
+        return table
+
+    def plain(table):
+        # Compare decoded values: dictionaries legitimately differ between inputs and output
+        return {
+            name: (table[name].cast(table[name].type.value_type) if pa.types.is_dictionary(table[name].type) else table[name]).to_pylist()
+            for name in table.column_names if name != 'seq'
+        }
+
+    def check(tag: str, input_files: list, expected: dict):
+        out = input_files[0].parent / f"kway_{tag}.parquet"
+        meta = StreamingMergeWriter(
+            input_files,
+            out,
+            batch_size=7,
+            output_buffer_size=5,
+            in_memory_max_rows=0,         # never the in-memory sort
+            force_disable_fastpath=True,  # never the fast concat
+        ).merge()
+        table = pq.read_table(out)
+        n_rows = len(expected['ts_event'])
+        assert meta['rows'] == n_rows, f"{tag}: row count {meta['rows']} != {n_rows}"
+        assert plain(table) == expected, f"{tag}: merged rows differ from reference"
+        assert table['seq'].to_pylist() == list(range(n_rows)), f"{tag}: seq not 0..N-1"
+        assert meta['ts_event_min'] == min(expected['ts_event']), f"{tag}: ts_event_min {meta['ts_event_min']}"
+        assert meta['ts_event_max'] == max(expected['ts_event']), f"{tag}: ts_event_max {meta['ts_event_max']}"
+        print(f"      ✓ {tag}: {n_rows} rows, seq and ts_event range match the reference")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+
+        # Overlapping sorted files over a narrow ts range: many equal ts_event values across files
+        sorted_files, sorted_tables = [], []
+        for file_no in range(5):
+            ts = sorted(rnd.randint(0, 60) for _ in range(rnd.randint(40, 90)))
+            path = tmpdir / f"part{file_no}.parquet"
+            sorted_tables.append(create_kway_parquet(path, file_no, ts))
+            sorted_files.append(path)
+
+        # Reference: inputs concatenated in file order, stable-sorted by ts_event
+        concat = pa.concat_tables([t.cast(t.schema.set(1, pa.field('symbol', pa.string()))) for t in sorted_tables])
+        check("sorted inputs", sorted_files, plain(concat.sort_by([('ts_event', 'ascending')])))
+
+        # Add one unsorted file. The k-way merge keeps each file's own row order (it only ever
+        # compares stream heads), so no global sort can be the reference here; a head-by-head
+        # merge of the inputs keyed by (ts_event, file order) is.
+        unsorted_ts = [rnd.randint(0, 60) for _ in range(70)]
+        path = tmpdir / "part5.parquet"
+        all_tables = sorted_tables + [create_kway_parquet(path, 5, unsorted_ts)]
+        rows = [list(zip(*plain(t).values())) for t in all_tables]
+        merged = list(heapq.merge(*rows, key=lambda r: r[0]))  # ties go to the earlier file
+        expected = {name: [r[i] for r in merged] for i, name in enumerate(('ts_event', 'symbol', 'row'))}
+        check("with unsorted input", sorted_files + [path], expected)
+
+        # Nested column ahead of ts_event: its Arrow field index is not its Parquet column-chunk
+        # index, so footer statistics must be looked up by the latter
+        nested_files, nested_tables = [], []
+        for file_no, ts in enumerate(([10, 20, 30], [1, 2, 3])):
+            table = pa.table({
+                'book': pa.array([{'bid': t, 'ask': 1000 - 10 * t} for t in ts]),  # leaf 1 ranks the files backwards
+                'ts_event': pa.array(ts, type=pa.int64()),
+                'row': pa.array([f'n{file_no}:{i}' for i in range(len(ts))], type=pa.string()),
+            })
+            path = tmpdir / f"nested{file_no}.parquet"
+            pq.write_table(table, path)
+            nested_tables.append(table)
+            nested_files.append(path)
+        check("nested column first", nested_files, plain(pa.concat_tables(nested_tables).sort_by([('ts_event', 'ascending')])))
+
+        print("\n✅ K-WAY MERGE TEST PASSED\n")
+
+
 if __name__ == "__main__":
     import argparse
     
@@ -260,6 +402,7 @@ if __name__ == "__main__":
     parser.add_argument("--files", nargs="*", help="Input parquet files to test")
     parser.add_argument("--synthetic", action="store_true", help="Run synthetic data test")
     parser.add_argument("--dict-hier", action="store_true", help="Run dictionary + hierarchical merge test")
+    parser.add_argument("--kway", action="store_true", help="Run streaming k-way merge test (merge rounds, single-row path)")
     
     args = parser.parse_args()
     
@@ -268,6 +411,9 @@ if __name__ == "__main__":
 
     if args.dict_hier:
         run_dictionary_hierarchical_test()
+
+    if args.kway:
+        run_kway_merge_test()
     
     if args.files:
         input_files = [Path(f) for f in args.files]
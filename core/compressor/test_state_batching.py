@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+QuantLab State Batching Test
+
+Verifies the batched StateManager (run.py workers):
+1. The latest queued status per partition wins, in one state write
+2. A synchronous write (in_progress) drops a queued status for the same partition
+3. get_partition_status sees queued statuses before they are flushed
+4. A non-success terminal status is in _state.json before the partition lock is released
+5. close() stops the flush thread and writes the queue
+"""
+
+import io
+import sys
+import json
+import hashlib
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+# Add parent dir to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import compact
+from compact import CompactionJob, PartitionKeys, StateManager
+
+
+def _client_error(code: str) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'Op')
+
+
+class FakeS3:
+    """In-memory stand-in for the S3 calls StateManager and CompactionJob make"""
+
+    def __init__(self):
+        self.objects = {}  # (bucket, key) -> bytes
+        self.state_puts = 0
+        self.on_delete = None  # callback(key) run before delete_object
+
+    def put_object(self, Bucket, Key, Body=b'', IfNoneMatch=None, **kwargs):
+        if IfNoneMatch == '*' and (Bucket, Key) in self.objects:
+            raise _client_error('PreconditionFailed')
+        self.objects[(Bucket, Key)] = Body
+        if Key.endswith('_state.json'):
+            self.state_puts += 1
+        return {'ETag': hashlib.md5(Body).hexdigest()}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('NoSuchKey')
+        body = self.objects[(Bucket, Key)]
+        etag = hashlib.md5(body).hexdigest()
+        if IfNoneMatch == etag:
+            raise _client_error('304')
+        return {'Body': io.BytesIO(body), 'ETag': etag}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('404')
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        if self.on_delete:
+            self.on_delete(Key)
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, name):
+        fake = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix='', **kwargs):
+                keys = sorted(k for b, k in fake.objects if b == Bucket and k.startswith(Prefix))
+                yield {'Contents': [{'Key': k, 'Size': len(fake.objects[(Bucket, k)])} for k in keys]}
+
+        return Paginator()
+
+    def state(self, bucket: str, key: str = compact.STATE_FILE_KEY) -> dict:
+        return json.loads(self.objects.get((bucket, key), b'{}'))
+
+
+def run_batching_test():
+    print("\n" + "="*60)
+    print("STATE BATCHING TEST")
+    print("="*60)
+
+    fake = FakeS3()
+    manager = StateManager(fake, 'compact', batch_updates=True, lock_backend='fcntl')
+    keys = PartitionKeys.build('binance', 'trade', 'btcusdt', '20260101')
+    other = PartitionKeys.build('binance', 'trade', 'ethusdt', '20260101')
+
+    # 1. Latest entry wins, one state write for the whole queue
+    manager.log_partition_status(keys, {'status': 'quarantine'})
+    manager.log_partition_status(keys, {'status': 'skipped'})
+    manager.log_partition_status(other, {'status': 'success', 'rows': 5})
+    assert fake.state_puts == 0, "Terminal status written synchronously in batched mode!"
+
+    # 3. Queued statuses are visible before the flush
+    assert manager.get_partition_status(keys)[0] == 'skipped', "Queued status not visible!"
+
+    manager.flush()
+    partitions = fake.state('compact')['partitions']
+    assert fake.state_puts == 1, f"Flush took {fake.state_puts} state writes, expected 1"
+    assert partitions[keys.partition_key]['status'] == 'skipped', "Latest queued status did not win!"
+    assert partitions[other.partition_key]['rows'] == 5
+    print("      ✓ latest queued status wins, one write per flush, queue visible to lookups")
+
+    # 2. A synchronous write supersedes a queued status for the same partition
+    manager.log_partition_status(keys, {'status': 'quarantine'})
+    manager.log_partition_status(keys, {}, status='in_progress')
+    manager.flush()
+    assert fake.state('compact')['partitions'][keys.partition_key]['status'] == 'in_progress', \
+        "Stale queued status overwrote a later synchronous write!"
+    print("      ✓ synchronous in_progress write drops the queued status")
+
+    # 5. close() stops the flush thread and writes what is still queued
+    manager.log_partition_status(other, {'status': 'quarantine'})
+    manager.close()
+    assert manager._flush_thread is None, "Flush thread still running after close()!"
+    assert fake.state('compact')['partitions'][other.partition_key]['status'] == 'quarantine', \
+        "close() did not flush the queue!"
+    print("      ✓ close() stops the flush thread and flushes")
+
+    print("\n✅ STATE BATCHING TEST PASSED\n")
+
+
+def run_release_lock_test():
+    print("\n" + "="*60)
+    print("FLUSH BEFORE LOCK RELEASE TEST")
+    print("="*60)
+
+    fake = FakeS3()
+    real_s3_client = compact._s3_client
+    compact._s3_client = lambda *args, **kwargs: fake
+    try:
+        job = CompactionJob('http://s3', 'a', 'b', 'c', 'd', 'raw', 'compact',
+                            batch_state_updates=True, state_lock_backend='fcntl')
+    finally:
+        compact._s3_client = real_s3_client
+
+    # No raw shards: the partition ends as no_files, a queued (non-success) terminal status
+    keys = PartitionKeys.build('binance', 'trade', 'btcusdt', '20260101')
+    seen = {}
+
+    def on_delete(key):
+        if key == keys.lock_key:
+            seen['status'] = fake.state('compact').get('partitions', {}).get(keys.partition_key, {}).get('status')
+
+    fake.on_delete = on_delete
+    try:
+        result = job.compact_date_partition('binance', 'trade', 'btcusdt', '20260101', overwrite=True)
+    finally:
+        job.close()
+    assert result['status'] == 'no_files', result
+    assert seen.get('status') == 'no_files', f"State at lock release: {seen.get('status')!r}, expected 'no_files'"
+    print("      ✓ no_files status committed before the partition lock was deleted")
+
+    print("\n✅ FLUSH BEFORE LOCK RELEASE TEST PASSED\n")
+
+
+if __name__ == "__main__":
+    run_batching_test()
+    run_release_lock_test()
+    print("All tests passed! ✅")